@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_READ_WORKERS,
+    thread_name_prefix='async-read')
+
+
+def run_read(view, request, *args, **kwargs):
+    """Выполняет чтение целиком в потоке пула, включая рендеринг ответа"""
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_read_view(view):
+    """Асинхронная обёртка над синхронным view: чтения выполняются
+    параллельно в пуле потоков, запись — в общем потоке, как у Django"""
+    read = sync_to_async(
+        partial(run_read, view), thread_sensitive=False, executor=executor)
+    write = sync_to_async(view)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            return await read(request, *args, **kwargs)
+        return await write(request, *args, **kwargs)
+
+    return wrapper
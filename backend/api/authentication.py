@@ -0,0 +1,167 @@
+import copy
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+User = get_user_model()
+
+STATELESS_USER_FIELDS = (
+    'username', 'email', 'first_name', 'last_name', 'is_staff')
+REVOCATION_KEY = 'token_revoked:{}'
+
+
+class TokenCache:
+    """LRU-кэш токен → (пользователь, токен) с ограниченным временем жизни.
+    Рядом с записью хранится метка отзыва пользователя на момент кэширования:
+    отзыв в другом воркере меняет метку в общем кэше, и запись перестаёт
+    действовать"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.user_keys = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, stamp, value = entry
+            if expires < time.monotonic():
+                self.discard(key)
+                return None
+            self.entries.move_to_end(key)
+        if stamp != revocation_stamp(value[0].pk):
+            self.invalidate(key)
+            return None
+        return value
+
+    def set(self, key, value):
+        stamp = revocation_stamp(value[0].pk)
+        with self.lock:
+            self.discard(key)
+            self.entries[key] = (time.monotonic() + self.ttl, stamp, value)
+            self.user_keys[value[0].pk].add(key)
+            while len(self.entries) > self.maxsize:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        """Удаляет запись вместе с её ключом в индексе; вызывать под lock"""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[2][0].pk
+        self.user_keys[user_id].discard(key)
+        if not self.user_keys[user_id]:
+            del self.user_keys[user_id]
+
+    def invalidate(self, key):
+        with self.lock:
+            self.discard(key)
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in self.user_keys.pop(user_id, ()):
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.user_keys.clear()
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+def revocation_stamp(user_id):
+    return cache.get(REVOCATION_KEY.format(user_id), 0)
+
+
+def revoke(user_id):
+    """Сбрасывает закэшированные токены пользователя во всех воркерах.
+    Метке достаточно жить TTL кэша: записи старше неё истекут сами"""
+    token_cache.invalidate_user(user_id)
+    cache.set(REVOCATION_KEY.format(user_id), time.time_ns(),
+              settings.TOKEN_CACHE_TTL)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Выход через djoser удаляет токен — убираем его и из кэша"""
+    token_cache.invalidate(instance.key)
+    transaction.on_commit(lambda: revoke(instance.user_id))
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields, **kwargs):
+    """Вход обновляет только last_login — это не повод сбрасывать токены"""
+    if not created and set(update_fields or ()) != {'last_login'}:
+        transaction.on_commit(lambda: revoke(instance.pk))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, запоминающий пользователя по токену, чтобы не
+    делать Token→User join на каждый запрос"""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            token_cache.set(key, cached)
+        user, token = cached
+        return copy.copy(user), token
+
+
+class StatelessTokenAuthentication(JWTAuthentication):
+    """Подписанный токен: пользователь собирается из его полей без
+    обращения к БД"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Токен не содержит идентификатор пользователя')
+        user = User(id=user_id, **{
+            field: validated_token[field]
+            for field in STATELESS_USER_FIELDS if field in validated_token})
+        user._state.adding = False
+        user._state.db = 'default'
+        return user
+
+
+class StatelessTokenObtainSerializer(TokenObtainPairSerializer):
+    """Выдаёт подписанные токены по email и паролю, как и djoser"""
+    username_field = 'email'
+
+    def validate(self, attrs):
+        user = User.objects.filter(email=attrs['email']).first()
+        if (user is None or not user.is_active
+                or not user.check_password(attrs['password'])):
+            raise AuthenticationFailed(
+                self.error_messages['no_active_account'],
+                'no_active_account')
+        refresh = self.get_token(user)
+        return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        for field in STATELESS_USER_FIELDS:
+            token[field] = getattr(user, field)
+        return token
@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from recipes.versions import get_version
+
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def encoding_quality(accept_encoding, coding):
+    """q-значение кодировки в Accept-Encoding; без упоминания — по «*»,
+    а без него 0"""
+    qualities = {}
+    for item in accept_encoding.split(','):
+        name, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get(coding, qualities.get('*', 0.0))
+
+
+class VersionedResponseCacheMixin:
+    """Кэш готовых ответов list/retrieve для справочных данных.
+
+    Ключ включает версии моделей из cache_models, которые сдвигаются
+    сигналами при любом изменении, поэтому устаревшие ответы просто
+    перестают запрашиваться. Рядом с телом ответа хранится его gzip-копия
+    и ETag, по которому отдаётся 304 на If-None-Match.
+    """
+    cache_models = ()
+
+    def get_response_cache_key(self, request):
+        versions = ':'.join(
+            str(get_version(model)) for model in self.cache_models)
+        raw_key = ':'.join((
+            self.basename, self.action, request.get_full_path(), versions))
+        return 'response:' + hashlib.md5(raw_key.encode()).hexdigest()
+
+    def render_for_cache(self, response):
+        response.accepted_renderer = self.request.accepted_renderer
+        response.accepted_media_type = self.request.accepted_media_type
+        response.renderer_context = self.get_renderer_context()
+        content = response.render().content
+        etag = hashlib.sha1(content).hexdigest()
+        return {
+            'status': response.status_code,
+            'content_type': response['Content-Type'],
+            'etag': f'"{etag}"',
+            'gzip_etag': f'"{etag}-gzip"',
+            'content': content,
+            'gzip_content': gzip.compress(content),
+        }
+
+    def cached_response(self, view, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return view(request, *args, **kwargs)
+        key = self.get_response_cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            entry = self.render_for_cache(response)
+            cache.set(key, entry, RESPONSE_CACHE_TIMEOUT)
+        if self.not_modified(request, entry):
+            response = HttpResponseNotModified()
+            response['ETag'] = entry['etag']
+        elif encoding_quality(
+                request.headers.get('Accept-Encoding', ''), 'gzip') > 0:
+            response = HttpResponse(
+                entry['gzip_content'], content_type=entry['content_type'])
+            response['Content-Encoding'] = 'gzip'
+            response['ETag'] = entry['gzip_etag']
+        else:
+            response = HttpResponse(
+                entry['content'], content_type=entry['content_type'])
+            response['ETag'] = entry['etag']
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        return response
+
+    @staticmethod
+    def not_modified(request, entry):
+        """If-None-Match сравнивается слабо: W/ перед тегом не важен"""
+        etags = parse_etags(request.headers.get('If-None-Match', ''))
+        return '*' in etags or not {
+            etag.removeprefix('W/') for etag in etags
+        }.isdisjoint((entry['etag'], entry['gzip_etag']))
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
@@ -1,6 +1,12 @@
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    TrigramSimilarity
+)
+from django.db.models import F, Q
 from django_filters import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import SEARCH_CONFIG, Ingredient, Recipe, Tag
 
 
 class RecipeFilter(FilterSet):
@@ -20,6 +26,9 @@ class RecipeFilter(FilterSet):
     is_favorited = filters.NumberFilter(
         method='is_favorited_filter',
     )
+    search = filters.CharFilter(
+        method='search_filter',
+    )
 
     class Meta:
         model = Recipe
@@ -27,14 +36,26 @@ class RecipeFilter(FilterSet):
 
     def is_in_shopping_cart_filter(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(shopping_recipes__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
     def is_favorited_filter(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favorite_recipes__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
+    def search_filter(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, ингредиентам и тексту,
+        плюс нечёткое совпадение названия; сортировка по релевантности"""
+        query = SearchQuery(
+            value, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.annotate(
+            rank=SearchRank(F('search_vector'), query),
+            similarity=TrigramSimilarity('name', value),
+        ).filter(
+            Q(search_vector=query) | Q(name__trigram_similar=value)
+        ).order_by('-rank', '-similarity', '-id')
+
 
 class IngredientFilter(FilterSet):
     """Кастомный фильтр для ингрединтов"""
@@ -0,0 +1,47 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """Пагинация по ключу id: без COUNT и OFFSET, курсоры непрозрачны"""
+    ordering = '-id'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class LimitPageNumberPagination(PageNumberPagination):
+    """Постраничная пагинация с размером страницы в ?limit="""
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class PageNumberOrCursorPagination(LimitPageNumberPagination):
+    """Постраничная пагинация по умолчанию.
+
+    С ?pagination=cursor (и на всех следующих страницах, где передан
+    ?cursor=) выдача идёт по ключу через IdCursorPagination: стоимость
+    любой страницы одинакова, но порядок всегда от новых к старым.
+    """
+    mode_query_param = 'pagination'
+    cursor_pagination = None
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or IdCursorPagination.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_pagination = IdCursorPagination()
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.to_html()
+        return super().to_html()
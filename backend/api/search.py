@@ -0,0 +1,190 @@
+import logging
+import threading
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.db import close_old_connections
+
+from recipes.models import Ingredient, IngredientRecipe
+from recipes.versions import get_version
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pantry-index')
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Названия хранятся отсортированными в casefold: совпадения по началу
+    названия ищутся бинарным поиском, по подстроке — поиском в общей
+    строке из всех названий. Индекс строится при первом обращении
+    и перестраивается, когда меняется версия модели Ingredient.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._snapshot = None
+
+    def _build(self):
+        rows = sorted(
+            (ingredient.name.casefold(), ingredient.pk, ingredient)
+            for ingredient in Ingredient.objects.all())
+        names = [name for name, _, _ in rows]
+        ingredients = [ingredient for _, _, ingredient in rows]
+        offsets = []
+        offset = 0
+        for name in names:
+            offsets.append(offset)
+            offset += len(name) + 1
+        return names, ingredients, offsets, '\n'.join(names)
+
+    def _get_snapshot(self):
+        version = get_version(Ingredient)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._snapshot = self._build()
+                    self._version = version
+        return self._snapshot
+
+    def search(self, query):
+        """Сначала ингредиенты, начинающиеся с query, затем содержащие его"""
+        names, ingredients, offsets, blob = self._get_snapshot()
+        query = query.strip().casefold()
+        if not query:
+            return sorted(ingredients, key=lambda ingredient: ingredient.pk)
+        start = end = bisect_left(names, query)
+        while end < len(names) and names[end].startswith(query):
+            end += 1
+        found = ingredients[start:end]
+        position = blob.find(query)
+        while position != -1:
+            row = bisect_left(offsets, position + 1) - 1
+            if not start <= row < end:
+                found.append(ingredients[row])
+            position = blob.find(query, offsets[row] + len(names[row]) + 1)
+        return found
+
+
+class PantrySnapshot:
+    """Обратный индекс ингредиент → рецепты.
+
+    Рецепты пронумерованы по возрастанию id. Список рецептов ингредиента
+    хранится как в Roaring: редкие ингредиенты — отсортированным массивом
+    номеров, частые — упакованной битовой картой, смотря что меньше.
+    """
+    def __init__(self, links):
+        self.recipe_ids, rows = np.unique(links[:, 0], return_inverse=True)
+        self.sizes = np.bincount(rows).astype(np.int32)
+        order = np.lexsort((rows, links[:, 1]))
+        ingredients, starts = np.unique(
+            links[order, 1], return_index=True)
+        self.arrays = {}
+        self.bitmaps = {}
+        bitmap_threshold = len(self.recipe_ids) // 32
+        for ingredient, postings in zip(
+                ingredients.tolist(),
+                np.split(rows[order].astype(np.uint32), starts[1:])):
+            if len(postings) > bitmap_threshold:
+                bits = np.zeros(len(self.recipe_ids), dtype=np.uint8)
+                bits[postings] = 1
+                self.bitmaps[ingredient] = np.packbits(bits)
+            else:
+                self.arrays[ingredient] = postings
+
+    def coverage(self, ingredient_ids):
+        """Сколько ингредиентов из ingredient_ids есть в каждом рецепте"""
+        size = len(self.recipe_ids)
+        arrays = [
+            self.arrays[pk] for pk in ingredient_ids if pk in self.arrays]
+        have = np.bincount(
+            np.concatenate(arrays or [np.empty(0, np.uint32)]),
+            minlength=size).astype(np.int32)
+        bitmaps = [
+            self.bitmaps[pk] for pk in ingredient_ids if pk in self.bitmaps]
+        if bitmaps:
+            have += np.unpackbits(
+                np.stack(bitmaps), axis=1, count=size).sum(
+                    axis=0, dtype=np.int32)
+        return have
+
+    def rank(self, ingredient_ids, max_missing=None):
+        """id рецептов хотя бы с одним ингредиентом из ingredient_ids
+        и число недостающих: сначала те, где не хватает меньше всего"""
+        have = self.coverage(set(ingredient_ids))
+        rows = np.flatnonzero(have)
+        missing = self.sizes[rows] - have[rows]
+        if max_missing is not None:
+            rows, missing = rows[missing <= max_missing], (
+                missing[missing <= max_missing])
+        order = np.lexsort((-rows, -have[rows], missing))
+        return self.recipe_ids[rows[order]], missing[order]
+
+
+class PantryIndex:
+    """Индекс «что приготовить из имеющегося» в памяти процесса.
+
+    Первый раз строится при обращении, дальше при смене версии
+    IngredientRecipe перестраивается в фоне, а запросы до конца
+    перестройки отвечают по предыдущей копии.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._snapshot = None
+        self._rebuilding = False
+
+    def _build(self):
+        links = IngredientRecipe.objects.filter(
+            ingredients__isnull=False
+        ).values_list('recipe_id', 'ingredients_id')
+        return PantrySnapshot(
+            np.array(list(links), dtype=np.int64).reshape(-1, 2))
+
+    def rebuild(self):
+        """Строит индекс по текущим данным и подменяет им прежний"""
+        try:
+            version = get_version(IngredientRecipe)
+            snapshot = self._build()
+            with self._lock:
+                self._snapshot, self._version = snapshot, version
+        finally:
+            self._rebuilding = False
+
+    def _get_snapshot(self):
+        version = get_version(IngredientRecipe)
+        if version == self._version:
+            return self._snapshot
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = self._build()
+                self._version = version
+            elif not self._rebuilding:
+                self._rebuilding = True
+                schedule_rebuild(self)
+            return self._snapshot
+
+    def rank(self, ingredient_ids, max_missing=None):
+        return self._get_snapshot().rank(ingredient_ids, max_missing)
+
+
+def run_in_background(index):
+    close_old_connections()
+    try:
+        index.rebuild()
+    except Exception:
+        logger.exception('Не удалось перестроить индекс продуктов')
+    finally:
+        close_old_connections()
+
+
+def schedule_rebuild(index):
+    """Перестраивает индекс в фоне; один поток, чтобы перестройки
+    не шли одновременно"""
+    return executor.submit(run_in_background, index)
+
+
+ingredient_index = IngredientIndex()
+pantry_index = PantryIndex()
@@ -1,22 +1,33 @@
 import re
+from collections import Counter
 
 from django.contrib.auth import get_user_model
-from rest_framework import serializers, validators
+from django.db import transaction
+from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from recipes import models
+from recipes import models, shopping_list
+from recipes.derivatives import schedule_derivatives
+from recipes.feed import schedule_fan_out
+from recipes.similarity import schedule_refresh
+from recipes.versions import bump_version
 from users.models import Subscription
 
-from .utils import Base64ImageField
+from .utils import Base64ImageField, image_variant_url
 
 User = get_user_model()
 
+PANTRY_MAX_INGREDIENTS = 500
+BULK_MAX_RECIPES = 500
+
 
 class UserSerializer(serializers.ModelSerializer):
     """Для отображения пользователей"""
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context['request'].user
         if user.is_authenticated:
             return Subscription.objects.filter(
@@ -109,6 +120,7 @@ class RecipesSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     ingredients = serializers.SerializerMethodField()
+    image = serializers.SerializerMethodField()
     author = UserSerializer()
     tags = TagSerializer(many=True)
 
@@ -126,7 +138,14 @@ class RecipesSerializer(serializers.ModelSerializer):
             'text',
             'cooking_time')
 
+    def to_representation(self, instance):
+        if hasattr(instance, 'is_author_subscribed'):
+            instance.author.is_subscribed = instance.is_author_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         if user.is_authenticated:
             return models.FavoriteRecipes.objects.filter(
@@ -134,6 +153,8 @@ class RecipesSerializer(serializers.ModelSerializer):
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         if user.is_authenticated:
             return models.ShoppingCart.objects.filter(
@@ -141,10 +162,55 @@ class RecipesSerializer(serializers.ModelSerializer):
         return False
 
     def get_ingredients(self, obj):
-        ingredients = models.IngredientRecipe.objects.filter(recipe=obj)
-        serializer = IngredientRecipeSerializer(ingredients, many=True)
+        serializer = IngredientRecipeSerializer(obj.recipes.all(), many=True)
         return serializer.data
 
+    def get_image(self, obj):
+        view = self.context.get('view')
+        variant = 'full' if view and view.action == 'retrieve' else 'card'
+        return image_variant_url(obj, variant, self.context.get('request'))
+
+
+class ShoppingListSerializer(serializers.ModelSerializer):
+    """Строка списка покупок: ингредиент и сумма по рецептам корзины"""
+    id = serializers.IntegerField(source='ingredient_id')
+    name = serializers.CharField(source='ingredient.name')
+    measurement_unit = serializers.CharField(
+        source='ingredient.measurement_unit')
+
+    class Meta:
+        model = models.ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class PantryRecipeSerializer(RecipesSerializer):
+    """Рецепт в подборке по имеющимся ингредиентам"""
+    missing_ingredients = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipesSerializer.Meta):
+        fields = RecipesSerializer.Meta.fields + ('missing_ingredients',)
+
+
+class PantrySerializer(serializers.Serializer):
+    """Параметры подборки: id имеющихся ингредиентов и сколько
+    недостающих допустимо"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=PANTRY_MAX_INGREDIENTS)
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций"""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_MAX_RECIPES)
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
 
 class IngredientMiniSerializer(serializers.Serializer):
     """Вложенный сериализатор для полей ингредиентов при создании рецепта"""
@@ -156,9 +222,33 @@ class IngredientMiniSerializer(serializers.Serializer):
         fields = ('id', 'amount')
 
 
+class ManyPrimaryKeyRelatedField(serializers.ManyRelatedField):
+    """Список id, проверяемый одним запросом in_bulk вместо запроса
+    на каждый элемент"""
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        pks = list(data)
+        for pk in pks:
+            if isinstance(pk, bool) or not isinstance(pk, int):
+                raise ValidationError(
+                    f'Ожидался целый id, получено {pk!r} '
+                    f'({type(pk).__name__})')
+        found = self.child_relation.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in found:
+                self.child_relation.fail('does_not_exist', pk_value=pk)
+        return [found[pk] for pk in pks]
+
+
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Для отображения нужных полей при создании рецепта"""
     ingredients = IngredientMiniSerializer(many=True)
+    tags = ManyPrimaryKeyRelatedField(
+        child_relation=serializers.PrimaryKeyRelatedField(
+            queryset=models.Tag.objects.all()))
     image = Base64ImageField()
 
     class Meta:
@@ -171,24 +261,22 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             'text',
             'cooking_time')
 
-        validators = [
-            validators.UniqueTogetherValidator(
-                queryset=models.Ingredient.objects.all(),
-                fields=['ingredients']
-            )
-        ]
-
     def validate_ingredients(self, value):
-        tmp_list = []
-        for i in range(len(value)):
-            if value[i]['id'] not in tmp_list:
-                tmp_list.append(value[i]['id'])
-            else:
-                ingredient_name = models.Ingredient.objects.get(
-                    id=value[i]['id'])
-                raise ValidationError(
-                    f'Ингредиент: <{ingredient_name}> добавлен более одного '
-                    'раза, а так делать нельзя')
+        ids = [item['id'] for item in value]
+        found = models.Ingredient.objects.in_bulk(ids)
+        missing = sorted(set(ids) - found.keys())
+        if missing:
+            raise ValidationError(
+                'Ингредиентов с id: '
+                f'{", ".join(map(str, missing))} не существует')
+        duplicates = [
+            found[pk] for pk, count in Counter(ids).items() if count > 1]
+        if duplicates:
+            raise ValidationError(
+                f'Ингредиент: <{", ".join(map(str, duplicates))}> добавлен '
+                'более одного раза, а так делать нельзя')
+        for item in value:
+            item['ingredient'] = found[item['id']]
         return value
 
     def validate_cooking_time(self, value):
@@ -198,42 +286,93 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
     def ingredients_and_tags_set(self, recipe, tags, ingredients):
         recipe.tags.set(tags)
-        print(tags)
-        ingredients_list = []
-        for ingredient in ingredients:
-            ingredients_list.append(models.IngredientRecipe(
-                ingredients=models.Ingredient.objects.get(
-                    pk=ingredient['id']),
+        models.IngredientRecipe.objects.bulk_create(
+            models.IngredientRecipe(
+                ingredients=ingredient['ingredient'],
                 recipe=recipe,
-                amount=ingredient['amount']))
-        models.IngredientRecipe.objects.bulk_create(ingredients_list)
+                amount=ingredient['amount'])
+            for ingredient in ingredients)
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
         recipe = models.Recipe.objects.create(
             author=self.context['request'].user, **validated_data)
         self.ingredients_and_tags_set(recipe, tags_data, ingredients_data)
+        transaction.on_commit(lambda: schedule_derivatives(recipe.pk))
+        transaction.on_commit(lambda: schedule_fan_out(recipe.pk))
+        transaction.on_commit(lambda: schedule_refresh(recipe.pk))
+        transaction.on_commit(
+            lambda: bump_version(models.IngredientRecipe))
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """Меняет только те строки состава, что отличаются от текущих;
+        возвращает id ингредиентов, чьё количество изменилось"""
+        amounts = {
+            item['ingredient'].pk: item['amount'] for item in ingredients}
+        changed, removed = [], []
+        for row in recipe.recipes.all():
+            amount = amounts.pop(row.ingredients_id, None)
+            if amount is None:
+                removed.append(row)
+            elif amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        if removed:
+            models.IngredientRecipe.objects.filter(
+                pk__in=[row.pk for row in removed]).delete()
+        if changed:
+            models.IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        if amounts:
+            models.IngredientRecipe.objects.bulk_create(
+                models.IngredientRecipe(
+                    ingredients_id=pk, recipe=recipe, amount=amount)
+                for pk, amount in amounts.items())
+        return {row.ingredients_id for row in removed + changed} | set(
+            amounts)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.image = validated_data.get('image', instance.image)
-        instance.name = validated_data.get('name', instance.name)
-        instance.text = validated_data.get('text', instance.text)
-        instance.cooking_time = validated_data.get(
-            'cooking_time', instance.cooking_time)
-        ingredients_data = validated_data.pop('ingredients')
-        tags_data = validated_data.pop('tags')
-        models.IngredientRecipe.objects.filter(
-            recipe=instance,
-            ingredients__in=instance.ingredients.all()).delete()
-        self.ingredients_and_tags_set(instance, tags_data, ingredients_data)
-        instance.save()
+        ingredients_data = validated_data.pop('ingredients', None)
+        tags_data = validated_data.pop('tags', None)
+        update_fields = list(validated_data)
+        if 'image' in validated_data:
+            replaced = instance.image_derivatives
+            instance.image_derivatives = {}
+            update_fields.append('image_derivatives')
+            transaction.on_commit(
+                lambda: schedule_derivatives(instance.pk, replaced))
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        if update_fields:
+            instance.save(update_fields=update_fields)
+        if tags_data is not None:
+            instance.tags.set(tags_data)
+        ingredients_changed = ingredients_data is not None and (
+            self.update_ingredients(instance, ingredients_data))
+        if ingredients_changed:
+            shopping_list.rebuild(
+                models.ShoppingCart.objects.filter(
+                    recipe=instance).values('user_id'),
+                ingredients_changed - {None})
+        if ingredients_changed:
+            transaction.on_commit(
+                lambda: bump_version(models.IngredientRecipe))
+        if ingredients_changed or tags_data is not None:
+            transaction.on_commit(lambda: schedule_refresh(instance.pk))
         return instance
 
 
 class RecipeFollowSerializer(serializers.ModelSerializer):
     """Вложенный сериализатор для рецептов в подписках пользователя"""
+    image = serializers.SerializerMethodField()
+
+    def get_image(self, obj):
+        return image_variant_url(
+            obj, 'thumbnail', self.context.get('request'))
+
     class Meta:
         model = models.Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
@@ -242,28 +381,25 @@ class RecipeFollowSerializer(serializers.ModelSerializer):
 
 class SubscriptionSerializer(serializers.ModelSerializer):
     """Для отображения подпискок пользователя"""
+    ALREADY_SUBSCRIBED = 'подписка на данного пользавателя уже существует'
+
     is_subscribed = serializers.SerializerMethodField(read_only=True)
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context['request'].user
         return Subscription.objects.filter(user=user, author=obj).exists()
 
     def get_recipes(self, obj):
-        recipes = models.Recipe.objects.filter(author=obj)
+        recipes = obj.recipes.all()
         recipes_limit = self.context['request'].GET.get('recipes_limit')
-        if recipes_limit:
-            serializer = RecipeFollowSerializer(
-                recipes[:int(recipes_limit)], many=True)
-            return serializer.data
+        if recipes_limit and recipes_limit.isdigit():
+            recipes = recipes[:int(recipes_limit)]
         serializer = RecipeFollowSerializer(recipes, many=True)
         return serializer.data
 
-    def get_recipes_count(self, obj):
-        count = models.Recipe.objects.filter(author=obj).count()
-        return count
-
     class Meta:
         model = User
         fields = (
@@ -275,15 +411,14 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             'is_subscribed',
             'recipes',
             'recipes_count')
-        read_only_fields = ('email', 'username', 'first_name', 'last_name')
+        read_only_fields = (
+            'email', 'username', 'first_name', 'last_name', 'recipes_count')
 
     def validate(self, attrs):
+        """Повторную подписку отсекает сам INSERT … ON CONFLICT"""
         user = self.context['request'].user
         author = self.context.get('author')
         if user == author:
             raise ValidationError(
                 'Нелья подписаться на самого себя')
-        if Subscription.objects.filter(user=user, author=author).exists():
-            raise ValidationError(
-                'подписка на данного пользавателя уже существует')
         return attrs
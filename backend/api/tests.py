@@ -1,19 +1,69 @@
+import asyncio
+import io
+import tempfile
+import time
 from http import HTTPStatus
+from unittest import mock
 
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.files import File
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import path
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from recipes import derivatives
+from recipes.derivatives import build_derivatives, derivative_paths
+from recipes.feed import backfill
+from recipes.models import (
+    FavoriteRecipes,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag
+)
+from recipes.similarity import refresh
+from recipes.versions import get_version
+from users.models import Subscription
+
+from .async_views import async_read_view
+from .authentication import REVOCATION_KEY, token_cache
+from .search import pantry_index
+from .urls import ASYNC_READ_ROUTES, router
+from .utils import decode_base64
+
 # from django.urls import reverse
 
 
 User = get_user_model()
 
+SLOW_VIEW_SECONDS = 0.3
+
+
+def slow_view(request):
+    time.sleep(SLOW_VIEW_SECONDS)
+    return HttpResponse('ok')
+
+
+urlpatterns = [path('slow/', async_read_view(slow_view))]
+
 
 class PostUrlTests(TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
-        cls.user = User.objects.create_user(username='someuser')
-        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(
+            username='someuser', email='someuser@example.com')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com')
 
         cls.url_exists = {
             '/': HTTPStatus.OK,
@@ -40,3 +90,755 @@ class PostUrlTests(TestCase):
                     self.guest_client.get(page_name).status_code,
                     status
                 )
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncReadTests(SimpleTestCase):
+    """Чтения под ASGI со всеми MIDDLEWARE идут параллельно"""
+    REQUESTS = 8
+
+    def test_async_read_routes_exist(self):
+        self.assertLessEqual(
+            set(ASYNC_READ_ROUTES), {pattern.name for pattern in router.urls})
+
+    def test_reads_run_concurrently(self):
+        application = get_asgi_application()
+
+        async def get():
+            communicator = ApplicationCommunicator(application, {
+                'type': 'http', 'asgi': {'version': '3.0'},
+                'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': '/slow/', 'query_string': b'', 'headers': [],
+                'server': ('testserver', 80)})
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(timeout=10)
+            await communicator.receive_output(timeout=10)
+            return start['status']
+
+        async def get_all():
+            return await asyncio.gather(
+                *(get() for _ in range(self.REQUESTS)))
+
+        started = time.monotonic()
+        statuses = async_to_sync(get_all)()
+        elapsed = time.monotonic() - started
+        self.assertEqual(statuses, [HTTPStatus.OK] * self.REQUESTS)
+        self.assertLess(elapsed, SLOW_VIEW_SECONDS * self.REQUESTS / 2)
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TokenCacheTests(TestCase):
+    """Отзыв токена в одном воркере действует во всех"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='viewer', email='viewer@example.com')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(
+            self.client.get('/api/users/me/').status_code, HTTPStatus.OK)
+        self.assertIsNotNone(token_cache.get(self.token.key))
+
+    def test_revoked_in_another_worker(self):
+        cache.set(REVOCATION_KEY.format(self.user.pk), 1)
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(token_cache.user_keys, {})
+
+    def test_deactivated_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(
+            self.client.get('/api/users/me/').status_code,
+            HTTPStatus.UNAUTHORIZED)
+
+    def test_login_keeps_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save(update_fields=['last_login'])
+        self.assertIsNotNone(token_cache.get(self.token.key))
+
+
+SMALL_PNG = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageTests(TestCase):
+    """Приём картинок в base64 и их уменьшенные копии"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {number}',
+                image=File(decode_base64(SMALL_PNG.split(',')[1]),
+                           name='test.png'),
+                text='Текст', cooking_time=1)
+            for number in range(2)]
+
+    def test_decode_base64(self):
+        data = SMALL_PNG.split(',')[1]
+        wrapped = '\n'.join(
+            data[start:start + 7] for start in range(0, len(data), 7))
+        with mock.patch('api.utils.BASE64_CHUNK_SIZE', 8):
+            self.assertEqual(
+                decode_base64(wrapped).read(), decode_base64(data).read())
+            for broken in (data[:-1], data[:8] + '!' + data[9:]):
+                with self.subTest(broken=broken):
+                    with self.assertRaises(ValidationError):
+                        decode_base64(broken)
+
+    def test_rebuild_deletes_old_derivatives(self):
+        recipe = self.recipes[0]
+        storage = recipe.image.storage
+        old = derivative_paths(build_derivatives(recipe.pk))
+        new = derivative_paths(build_derivatives(recipe.pk))
+        self.assertTrue(old.isdisjoint(new))
+        self.assertFalse(any(storage.exists(path) for path in old))
+        self.assertTrue(all(storage.exists(path) for path in new))
+
+    @mock.patch('recipes.derivatives.close_old_connections')
+    def test_command_continues_after_errors(self, close_old_connections):
+        broken, recipe = self.recipes
+        Recipe.objects.filter(pk=broken.pk).update(
+            image='recipes/images/missing.png')
+        stderr = io.StringIO()
+        with mock.patch.object(derivatives.executor, 'map', map), \
+                self.assertLogs('recipes.derivatives', 'ERROR'):
+            call_command(
+                'build_image_derivatives', stdout=io.StringIO(),
+                stderr=stderr)
+        self.assertIn(f'Рецепт {broken.pk}', stderr.getvalue())
+        recipe.refresh_from_db()
+        self.assertNotEqual(recipe.image_derivatives, {})
+
+
+@override_settings(
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    MEDIA_ROOT=tempfile.mkdtemp())
+class ApiTestCase(TestCase):
+    """Общие данные и помощники тестов API: 16 рецептов 8 авторов,
+    подписки, избранное и корзина пользователя viewer"""
+    PAGE_SIZES = (2, 6)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = Tag.objects.bulk_create([
+            Tag(name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}')
+            for number in range(3)])
+        cls.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(12)])
+        cls.user = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            password='Viewer-pass-123')
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com')
+            for number in range(8)]
+        cls.recipes = []
+        for number in range(16):
+            recipe = Recipe.objects.create(
+                author=cls.authors[number % 8],
+                name=f'Рецепт {number}',
+                image='recipes/images/test.png',
+                text='Текст',
+                cooking_time=10)
+            recipe.tags.set(cls.tags[:2])
+            IngredientRecipe.objects.bulk_create([
+                IngredientRecipe(
+                    recipe=recipe, ingredients=ingredient, amount=5)
+                for ingredient in cls.ingredients[number % 4:][:3]])
+            cls.recipes.append(recipe)
+        for author in cls.authors:
+            Subscription.objects.create(user=cls.user, author=author)
+        for recipe in cls.recipes[:8]:
+            FavoriteRecipes.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.guest = APIClient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def request(self, client, method, url, data=None):
+        cache.clear()
+        token_cache.clear()
+        response = getattr(client, method)(url, data, format='json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def assertQueries(self, expected, client, method, url, data=None,
+                      status=HTTPStatus.OK):
+        with self.assertNumQueries(expected):
+            response = self.request(client, method, url, data)
+        self.assertEqual(response.status_code, status, url)
+        return response
+
+    def recipe_payload(self, ingredients):
+        return {
+            'name': 'Новый рецепт',
+            'text': 'Текст',
+            'cooking_time': 5,
+            'image': SMALL_PNG,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 3}
+                for ingredient in self.ingredients[:ingredients]],
+        }
+
+    def shopping_list_totals(self, user):
+        """Список покупок, посчитанный заново по корзине"""
+        totals = {}
+        for link in IngredientRecipe.objects.filter(
+                recipe__shopping_recipes__user=user):
+            totals[link.ingredients_id] = (
+                totals.get(link.ingredients_id, 0) + link.amount)
+        return totals
+
+
+class QueryCountTests(ApiTestCase):
+    """Число SQL-запросов каждого действия не зависит от размера выдачи"""
+
+    def test_recipe_list(self):
+        for client, expected in ((self.guest, 4), (self.client, 5)):
+            for size in self.PAGE_SIZES:
+                with self.subTest(client=client, size=size):
+                    self.assertQueries(
+                        expected, client, 'get',
+                        f'/api/recipes/?limit={size}&page=2')
+
+    def test_recipe_list_filtered(self):
+        query = (
+            f'is_favorited=1&is_in_shopping_cart=1&tags={self.tags[0].slug}')
+        for size in self.PAGE_SIZES:
+            with self.subTest(size=size):
+                self.assertQueries(
+                    6, self.client, 'get',
+                    f'/api/recipes/?{query}&limit={size}')
+                self.assertQueries(
+                    4, self.guest, 'get',
+                    f'/api/recipes/?author={self.authors[0].pk}'
+                    f'&limit={size}')
+
+    def test_recipe_retrieve(self):
+        url = f'/api/recipes/{self.recipes[0].pk}/'
+        self.assertQueries(3, self.guest, 'get', url)
+        self.assertQueries(4, self.client, 'get', url)
+
+    def test_recipe_create(self):
+        for ingredients in self.PAGE_SIZES:
+            with self.subTest(ingredients=ingredients):
+                payload = self.recipe_payload(ingredients)
+                payload['name'] += str(ingredients)
+                self.assertQueries(
+                    13, self.client, 'post', '/api/recipes/', payload,
+                    HTTPStatus.CREATED)
+        self.assertQueries(
+            0, self.guest, 'post', '/api/recipes/',
+            self.recipe_payload(2), HTTPStatus.UNAUTHORIZED)
+
+    def test_recipe_update(self):
+        for ingredients in self.PAGE_SIZES:
+            recipe = Recipe.objects.create(
+                author=self.user, name=f'Свой {ingredients}',
+                image='recipes/images/test.png', text='Текст',
+                cooking_time=1)
+            url = f'/api/recipes/{recipe.pk}/'
+            payload = self.recipe_payload(ingredients)
+            payload['name'] = recipe.name
+            with self.subTest(ingredients=ingredients):
+                self.assertQueries(17, self.client, 'patch', url, payload)
+                payload['cooking_time'] = 7
+                self.assertQueries(12, self.client, 'put', url, payload)
+
+    def test_recipe_destroy(self):
+        recipe = Recipe.objects.create(
+            author=self.user, name='Удаляемый',
+            image='recipes/images/test.png', text='Текст', cooking_time=1)
+        self.assertQueries(
+            11, self.client, 'delete', f'/api/recipes/{recipe.pk}/',
+            status=HTTPStatus.NO_CONTENT)
+
+    def test_favorite_and_shopping_cart(self):
+        recipe = self.recipes[-1]
+        for action, created, deleted in (
+                ('favorite', 3, 2), ('shopping_cart', 6, 6)):
+            url = f'/api/recipes/{recipe.pk}/{action}/'
+            with self.subTest(action=action):
+                self.assertQueries(
+                    created, self.client, 'post', url,
+                    status=HTTPStatus.CREATED)
+                self.assertQueries(
+                    deleted, self.client, 'delete', url,
+                    status=HTTPStatus.NO_CONTENT)
+
+    def test_download_shopping_cart(self):
+        buyer = self.authors[0]
+        for recipe in self.recipes[:2]:
+            ShoppingCart.objects.create(user=buyer, recipe=recipe)
+        buyer_client = APIClient()
+        buyer_client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=buyer)}')
+        for file_format in ('txt', 'csv', 'pdf'):
+            url = (
+                f'/api/recipes/download_shopping_cart/'
+                f'?file_format={file_format}')
+            for client in (self.client, buyer_client):
+                with self.subTest(file_format=file_format, client=client):
+                    self.assertQueries(2, client, 'get', url)
+
+    def test_user_list(self):
+        for size in self.PAGE_SIZES:
+            url = f'/api/users/?limit={size}&page=2'
+            with self.subTest(size=size):
+                self.assertQueries(3, self.client, 'get', url)
+                self.assertQueries(
+                    0, self.guest, 'get', url,
+                    status=HTTPStatus.UNAUTHORIZED)
+
+    def test_user_retrieve_and_me(self):
+        url = f'/api/users/{self.authors[0].pk}/'
+        self.assertQueries(2, self.client, 'get', url)
+        self.assertQueries(2, self.client, 'get', '/api/users/me/')
+        self.assertQueries(
+            0, self.guest, 'get', url, status=HTTPStatus.UNAUTHORIZED)
+        self.assertQueries(
+            0, self.guest, 'get', '/api/users/me/',
+            status=HTTPStatus.UNAUTHORIZED)
+
+    def test_user_create(self):
+        self.assertQueries(
+            3, self.guest, 'post', '/api/users/', {
+                'username': 'newbie', 'email': 'newbie@example.com',
+                'first_name': 'Имя', 'last_name': 'Фамилия',
+                'password': 'Newbie-pass-123'},
+            HTTPStatus.CREATED)
+
+    def test_set_password(self):
+        self.assertQueries(
+            3, self.client, 'post', '/api/users/set_password/', {
+                'current_password': 'Viewer-pass-123',
+                'new_password': 'Viewer-pass-456'},
+            HTTPStatus.NO_CONTENT)
+
+    def test_subscriptions(self):
+        for size in self.PAGE_SIZES:
+            for recipes_limit in (1, 3):
+                with self.subTest(size=size, recipes_limit=recipes_limit):
+                    self.assertQueries(
+                        4, self.client, 'get',
+                        f'/api/users/subscriptions/?limit={size}'
+                        f'&recipes_limit={recipes_limit}')
+
+    def test_subscribe(self):
+        author = User.objects.create_user(
+            username='fresh', email='fresh@example.com')
+        Recipe.objects.create(
+            author=author, name='Рецепт', image='recipes/images/test.png',
+            text='Текст', cooking_time=1)
+        url = f'/api/users/{author.pk}/subscribe/'
+        self.assertQueries(
+            4, self.client, 'post', f'{url}?recipes_limit=2',
+            status=HTTPStatus.CREATED)
+        self.assertQueries(
+            5, self.client, 'delete', url, status=HTTPStatus.NO_CONTENT)
+        author.refresh_from_db()
+        self.assertEqual(author.followers_count, 0)
+
+    def test_ingredients_and_tags(self):
+        urls = (
+            '/api/ingredients/',
+            '/api/ingredients/?name=ингр',
+            f'/api/ingredients/{self.ingredients[0].pk}/',
+            '/api/tags/',
+            f'/api/tags/{self.tags[0].pk}/')
+        for client, expected in ((self.guest, 1), (self.client, 2)):
+            for url in urls:
+                with self.subTest(client=client, url=url):
+                    self.assertQueries(expected, client, 'get', url)
+
+
+class RecipeValidationTests(ApiTestCase):
+    """Проверка входных данных рецепта"""
+
+    def test_tags_must_be_integers(self):
+        """id тегов не приводятся к int: 1.9 и '1.0' — ошибка"""
+        for tag in (1.9, '1.0', True):
+            with self.subTest(tag=tag):
+                payload = self.recipe_payload(2)
+                payload['tags'] = [self.tags[0].pk, tag]
+                response = self.request(
+                    self.client, 'post', '/api/recipes/', payload)
+                self.assertEqual(
+                    response.status_code, HTTPStatus.BAD_REQUEST)
+                self.assertIn(repr(tag), str(response.data['tags']))
+
+
+class CursorPaginationTests(ApiTestCase):
+    """Курсорная пагинация списка рецептов"""
+
+    def test_recipe_list_cursor(self):
+        newest = [recipe.pk for recipe in reversed(self.recipes)]
+        first = self.assertQueries(
+            3, self.guest, 'get', '/api/recipes/?pagination=cursor&limit=6')
+        self.assertEqual(
+            [item['id'] for item in first.data['results']], newest[:6])
+        self.assertIsNone(first.data['previous'])
+        second = self.assertQueries(
+            3, self.guest, 'get', first.data['next'])
+        self.assertEqual(
+            [item['id'] for item in second.data['results']], newest[6:12])
+        previous = self.assertQueries(
+            3, self.guest, 'get', second.data['previous'])
+        self.assertEqual(
+            [item['id'] for item in previous.data['results']], newest[:6])
+
+
+class FeedTests(ApiTestCase):
+    """Лента подписок из предрассчитанных записей"""
+
+    def test_feed(self):
+        backfill([self.user.pk])
+        for size in self.PAGE_SIZES:
+            with self.subTest(size=size):
+                self.assertQueries(
+                    6, self.client, 'get', f'/api/recipes/feed/?limit={size}')
+        self.assertQueries(
+            0, self.guest, 'get', '/api/recipes/feed/',
+            status=HTTPStatus.UNAUTHORIZED)
+
+
+class SimilarRecipesTests(ApiTestCase):
+    """Похожие рецепты"""
+
+    def test_similar(self):
+        recipe = self.recipes[0]
+        refresh(recipe.pk)
+        response = self.assertQueries(
+            2, self.guest, 'get', f'/api/recipes/{recipe.pk}/similar/')
+        self.assertEqual(
+            [item['id'] for item in response.data][:3],
+            [self.recipes[4].pk, self.recipes[8].pk, self.recipes[12].pk])
+        self.assertQueries(
+            1, self.guest, 'get', '/api/recipes/0/similar/',
+            status=HTTPStatus.NOT_FOUND)
+
+    def test_similar_follows_direct_writes(self):
+        """Соседи пересчитываются и при правке состава или тегов мимо API"""
+        recipe, tag = self.recipes[0], self.tags[-1]
+        with mock.patch('recipes.signals.schedule_refresh') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredients=self.ingredients[-1],
+                    amount=1)
+            schedule.assert_called_once_with(recipe.pk)
+            schedule.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe.tags.add(tag)
+            schedule.assert_called_once_with(recipe.pk)
+            schedule.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                tag.recipe_set.clear()
+        self.assertEqual(
+            {call.args[0] for call in schedule.call_args_list},
+            {recipe.pk})
+
+
+class PantryTests(ApiTestCase):
+    """Поиск рецептов по ингредиентам в кладовой"""
+
+    def test_pantry(self):
+        query = '&'.join(
+            f'ingredients={ingredient.pk}'
+            for ingredient in self.ingredients[:3])
+        # Индекс уже построен: смена версии только ставит перестройку
+        # в фон, запрос отвечает по текущей копии
+        pantry_index.rebuild()
+        with mock.patch('api.search.schedule_rebuild') as schedule_rebuild:
+            for client, expected in ((self.guest, 3), (self.client, 4)):
+                for size in self.PAGE_SIZES:
+                    with self.subTest(client=client, size=size):
+                        response = self.assertQueries(
+                            expected, client, 'get',
+                            f'/api/recipes/pantry/?{query}&limit={size}')
+        schedule_rebuild.assert_called_once_with(pantry_index)
+        pantry_index.rebuild()
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual(
+            [item['missing_ingredients'] for item in response.data['results']],
+            [0, 0, 0, 0, 1, 1])
+        self.assertEqual(
+            response.data['results'][0]['id'], self.recipes[12].pk)
+        self.assertQueries(
+            0, self.guest, 'get', '/api/recipes/pantry/?ingredients=x',
+            status=HTTPStatus.BAD_REQUEST)
+
+    def test_pantry_follows_direct_writes(self):
+        """Правка состава в обход API сдвигает версию индекса кладовой"""
+        ingredient = Ingredient.objects.create(
+            name='шафран', measurement_unit='г')
+        version = get_version(IngredientRecipe)
+        with mock.patch('recipes.signals.schedule_refresh'):
+            with self.captureOnCommitCallbacks(execute=True):
+                link = IngredientRecipe.objects.create(
+                    recipe=self.recipes[0], ingredients=ingredient, amount=1)
+            self.assertNotEqual(get_version(IngredientRecipe), version)
+            version = get_version(IngredientRecipe)
+            with self.captureOnCommitCallbacks(execute=True):
+                link.delete()
+        self.assertNotEqual(get_version(IngredientRecipe), version)
+
+
+class SearchTests(ApiTestCase):
+    """Полнотекстовый поиск рецептов"""
+
+    def test_search_follows_direct_writes(self):
+        """Поисковый вектор обновляется и при записи в обход API"""
+        recipe = self.recipes[0]
+        ingredient = Ingredient.objects.create(
+            name='шафран', measurement_unit='г')
+        link = IngredientRecipe.objects.create(
+            recipe=recipe, ingredients=ingredient, amount=1)
+
+        def found(query):
+            response = self.request(
+                self.guest, 'get', f'/api/recipes/?search={query}')
+            return [item['id'] for item in response.data['results']]
+
+        self.assertEqual(found('шафран'), [recipe.pk])
+        ingredient.name = 'кардамон'
+        ingredient.save()
+        self.assertEqual(found('кардамон'), [recipe.pk])
+        link.delete()
+        self.assertEqual(found('кардамон'), [])
+        recipe.name = 'Пирог'
+        recipe.save()
+        self.assertEqual(found('Пирог'), [recipe.pk])
+
+
+class RelationTests(ApiTestCase):
+    """Избранное, корзина и подписки: повторы и пакетные операции"""
+
+    def test_repeated_toggles(self):
+        recipe = self.recipes[-1]
+        for action in ('favorite', 'shopping_cart'):
+            url = f'/api/recipes/{recipe.pk}/{action}/'
+            with self.subTest(action=action):
+                for expected in (HTTPStatus.CREATED, HTTPStatus.BAD_REQUEST):
+                    self.assertEqual(
+                        self.request(self.client, 'post', url).status_code,
+                        expected)
+                recipe.refresh_from_db()
+                self.assertEqual(
+                    (recipe.favorites_count, recipe.in_carts_count),
+                    (action == 'favorite', action == 'shopping_cart'))
+                for expected in (
+                        HTTPStatus.NO_CONTENT, HTTPStatus.BAD_REQUEST):
+                    self.assertEqual(
+                        self.request(self.client, 'delete', url).status_code,
+                        expected)
+                self.assertEqual(self.request(
+                    self.client, 'post', f'/api/recipes/{10 ** 9}/{action}/'
+                ).status_code, HTTPStatus.NOT_FOUND)
+        recipe.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.in_carts_count), (0, 0))
+        self.assertEqual(
+            {item.ingredient_id: item.amount
+             for item in self.user.shopping_list.all()},
+            self.shopping_list_totals(self.user))
+        author = self.authors[0]
+        url = f'/api/users/{author.pk}/subscribe/'
+        self.assertEqual(
+            self.request(self.client, 'post', url).status_code,
+            HTTPStatus.BAD_REQUEST)
+        self.assertEqual(
+            self.request(
+                self.client, 'post', f'/api/users/{self.user.pk}/subscribe/'
+            ).status_code,
+            HTTPStatus.BAD_REQUEST)
+        author.refresh_from_db()
+        self.assertEqual(author.followers_count, 1)
+
+    def test_bulk_favorite_and_shopping_cart(self):
+        for model, action, created, deleted, counters in (
+                (FavoriteRecipes, 'favorite', 6, 6, (1, 0)),
+                (ShoppingCart, 'shopping_cart', 7, 8, (0, 1))):
+            url = f'/api/recipes/{action}/bulk/'
+            for size in self.PAGE_SIZES:
+                recipes = [
+                    recipe.pk for recipe in self.recipes[6:8 + size]]
+                payload = {'recipes': [*recipes, recipes[0], 10 ** 9]}
+                with self.subTest(action=action, size=size):
+                    response = self.assertQueries(
+                        created, self.client, 'post', url, payload)
+                    self.assertEqual(
+                        [item['status'] for item in response.data['results']],
+                        ['already_in_list'] * 2 + ['added'] * size
+                        + ['not_found'])
+                    response = self.request(self.client, 'post', url, payload)
+                    self.assertEqual(
+                        [item['status'] for item in response.data['results']],
+                        ['already_in_list'] * (size + 2) + ['not_found'])
+                    recipe = Recipe.objects.get(pk=recipes[-1])
+                    self.assertEqual(
+                        (recipe.favorites_count, recipe.in_carts_count),
+                        counters)
+                    self.assertEqual(
+                        {item.ingredient_id: item.amount
+                         for item in self.user.shopping_list.all()},
+                        self.shopping_list_totals(self.user))
+                    response = self.assertQueries(
+                        deleted, self.client, 'delete', url, payload)
+                    self.assertEqual(
+                        [item['status'] for item in response.data['results']],
+                        ['removed'] * (size + 2) + ['not_found'])
+                    for recipe in self.recipes[6:8]:
+                        model.objects.create(user=self.user, recipe=recipe)
+                    recipe = Recipe.objects.get(pk=recipes[-1])
+                    self.assertEqual(
+                        (recipe.favorites_count, recipe.in_carts_count),
+                        (0, 0))
+        self.assertEqual(
+            {item.ingredient_id: item.amount
+             for item in self.user.shopping_list.all()},
+            self.shopping_list_totals(self.user))
+        self.assertQueries(
+            1, self.client, 'post', '/api/recipes/favorite/bulk/',
+            {'recipes': []}, status=HTTPStatus.BAD_REQUEST)
+
+
+class ShoppingListTests(ApiTestCase):
+    """Денормализованный список покупок"""
+
+    def test_shopping_list(self):
+        buyer = self.authors[0]
+        recipe = Recipe.objects.create(
+            author=self.user, name='В корзине',
+            image='recipes/images/test.png', text='Текст', cooking_time=1)
+        for cart_recipe in (*self.recipes[:2], recipe):
+            ShoppingCart.objects.create(user=buyer, recipe=cart_recipe)
+        buyer_client = APIClient()
+        buyer_client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=buyer)}')
+
+        for ingredients in self.PAGE_SIZES:
+            with self.subTest(ingredients=ingredients):
+                self.request(
+                    self.client, 'patch', f'/api/recipes/{recipe.pk}/',
+                    self.recipe_payload(ingredients))
+                response = self.assertQueries(
+                    2, buyer_client, 'get', '/api/recipes/shopping_list/')
+                self.assertEqual(
+                    {item['id']: item['amount'] for item in response.data},
+                    self.shopping_list_totals(buyer))
+        self.request(
+            buyer_client, 'delete', f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.request(
+            buyer_client, 'post', f'/api/recipes/{recipe.pk}/shopping_cart/')
+        recipe.delete()
+        response = self.request(
+            buyer_client, 'get', '/api/recipes/shopping_list/')
+        self.assertEqual(
+            {item['id']: item['amount'] for item in response.data},
+            self.shopping_list_totals(buyer))
+
+    def test_shopping_list_follows_direct_writes(self):
+        """Правка состава в обход API пересчитывает списки покупок"""
+        buyer = self.user
+        recipe = self.recipes[0]
+        ingredient = Ingredient.objects.create(
+            name='шафран', measurement_unit='г')
+
+        def assertShoppingList():
+            self.assertEqual(
+                dict(buyer.shopping_list.values_list(
+                    'ingredient_id', 'amount')),
+                self.shopping_list_totals(buyer))
+
+        with mock.patch('recipes.signals.schedule_refresh'):
+            with self.captureOnCommitCallbacks(execute=True):
+                link = IngredientRecipe.objects.create(
+                    recipe=recipe, ingredients=ingredient, amount=3)
+            assertShoppingList()
+            with self.captureOnCommitCallbacks(execute=True):
+                link.ingredients = self.ingredients[-1]
+                link.amount = 7
+                link.save()
+            assertShoppingList()
+            with self.captureOnCommitCallbacks(execute=True):
+                link.delete()
+        assertShoppingList()
+
+
+class ResponseCacheTests(ApiTestCase):
+    """Кэш готовых ответов справочников"""
+
+    def test_tags_etag(self):
+        """Справочник отдаёт 304 на свой ETag, а после правки тега —
+        новый ответ с другим ETag"""
+        url = '/api/tags/'
+        response = self.request(self.guest, 'get', url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.guest.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response['Vary'], 'Accept, Accept-Encoding')
+        for if_none_match in (f'"other", W/{etag}', '*'):
+            with self.subTest(if_none_match=if_none_match):
+                response = self.guest.get(
+                    url, HTTP_IF_NONE_MATCH=if_none_match)
+                self.assertEqual(
+                    response.status_code, HTTPStatus.NOT_MODIFIED)
+        for accept_encoding, encoding in (
+                ('gzip, deflate', 'gzip'), ('gzip;q=0, br', None),
+                ('*;q=0.5', 'gzip')):
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.guest.get(
+                    url, HTTP_ACCEPT_ENCODING=accept_encoding)
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+        tag = self.tags[0]
+        tag.name = 'Переименованный тег'
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.save()
+        response = self.guest.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, tag.name)
+
+
+class SqlProfileTests(ApiTestCase):
+    """Профилирование SQL по заголовку X-SQL-Profile"""
+
+    def test_sql_profile_header(self):
+        """X-SQL-Profile включает профилирование только сотрудникам или
+        всем при SQL_PROFILE_HEADER_ENABLED"""
+        url = '/api/tags/'
+        response = self.guest.get(url, HTTP_X_SQL_PROFILE='1')
+        self.assertNotIn('Server-Timing', response)
+        staff = Client()
+        staff.force_login(User.objects.create_user(
+            username='staff', email='staff@example.com', is_staff=True))
+        response = staff.get(url, HTTP_X_SQL_PROFILE='1')
+        self.assertIn('Server-Timing', response)
+        with self.settings(SQL_PROFILE_HEADER_ENABLED=True):
+            response = self.guest.get(url, HTTP_X_SQL_PROFILE='1')
+        self.assertIn('Server-Timing', response)
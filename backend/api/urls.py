@@ -1,15 +1,32 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .async_views import async_read_view
 from .views import IngredientsViewSet, RecipesViewSet, TagViewSet, UsersViewSet
 
+ASYNC_READ_ROUTES = (
+    'ingredient-list', 'ingredient-detail',
+    'recipe-list', 'recipe-detail', 'recipe-similar', 'recipe-pantry',
+    'tag-list', 'tag-detail',
+    'user-subscriptions',
+)
+
 router = DefaultRouter()
 router.register('ingredients', IngredientsViewSet)
 router.register('recipes', RecipesViewSet)
 router.register('tags', TagViewSet)
 router.register('users', UsersViewSet)
 
+if settings.ASYNC_READ_VIEWS:
+    for pattern in router.urls:
+        if pattern.name in ASYNC_READ_ROUTES:
+            pattern.callback = async_read_view(pattern.callback)
+
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+if settings.STATELESS_AUTH:
+    urlpatterns.append(path('auth/', include('djoser.urls.jwt')))
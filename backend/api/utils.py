@@ -1,8 +1,48 @@
 import base64
+import binascii
+import csv
+import io
+import tempfile
+from functools import lru_cache
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files import File
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
 from rest_framework import serializers
 
+PDF_MARGIN = 40
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 18
+PDF_CHUNK_SIZE = 64 * 1024
+BASE64_CHUNK_SIZE = 4 * 64 * 1024
+BASE64_SPOOL_SIZE = 1024 * 1024
+
+
+def decode_base64(data):
+    """Декодирует base64 частями во временный файл: крупные картинки
+    уходят на диск, а не копируются целиком в память. Пробелы и переносы
+    строк выбрасываются, а хвост части, не кратный четырём символам,
+    переносится в следующую"""
+    decoded = tempfile.SpooledTemporaryFile(max_size=BASE64_SPOOL_SIZE)
+    tail = ''
+    try:
+        for start in range(0, len(data), BASE64_CHUNK_SIZE):
+            chunk = tail + ''.join(
+                data[start:start + BASE64_CHUNK_SIZE].split())
+            aligned = len(chunk) - len(chunk) % 4
+            decoded.write(base64.b64decode(chunk[:aligned], validate=True))
+            tail = chunk[aligned:]
+        decoded.write(base64.b64decode(tail, validate=True))
+    except binascii.Error as error:
+        decoded.close()
+        raise serializers.ValidationError(
+            f'Картинка не в формате base64: {error}')
+    decoded.seek(0)
+    return decoded
+
 
 class Base64ImageField(serializers.ImageField):
     """Кастомное поле для картинки"""
@@ -10,19 +50,75 @@ class Base64ImageField(serializers.ImageField):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='rec.' + ext)
+            data = File(decode_base64(imgstr), name='rec.' + ext)
         return super().to_internal_value(data)
 
 
-def get_ingredients_for_file(ingredients):
-    """Получение списка ингредиентов для выгрузки"""
-    ing_dct = {}
-    for el in ingredients:
-        if el.ingredients not in ing_dct:
-            ing_dct[el.ingredients] = [
-                el.ingredients.name,
-                el.ingredients.measurement_unit,
-                el.amount]
-        ing_dct[el.ingredients][2] += el.amount
-    return (ing_dct[el][0].title() + ' (' + ing_dct[el][1] + ') -- '
-            + str(ing_dct[el][2]) + '\n' for el in ing_dct)
+def image_variant_url(recipe, variant, request=None):
+    """Ссылка на уменьшенную копию картинки рецепта; пока копии
+    не готовы — на оригинал"""
+    path = recipe.image_derivatives.get(variant, {}).get(
+        settings.IMAGE_DERIVATIVE_FORMAT)
+    url = recipe.image.storage.url(path) if path else recipe.image.url
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+class Echo:
+    """Буфер-заглушка: csv.writer отдаёт строку сразу в генератор"""
+    def write(self, value):
+        return value
+
+
+def shopping_list_txt(ingredients):
+    """Список покупок построчно в текстовом виде"""
+    for item in ingredients:
+        yield (f'{item["name"].title()} ({item["measurement_unit"]}) -- '
+               f'{item["total_amount"]}\n')
+
+
+def shopping_list_csv(ingredients):
+    """Список покупок в CSV"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for item in ingredients:
+        yield writer.writerow((
+            item['name'], item['measurement_unit'], item['total_amount']))
+
+
+@lru_cache(maxsize=None)
+def register_pdf_font():
+    """Шрифт читается и разбирается один раз на процесс"""
+    pdfmetrics.registerFont(
+        TTFont('ShoppingListFont', settings.SHOPPING_LIST_PDF_FONT))
+
+
+def shopping_list_pdf(ingredients):
+    """Список покупок в PDF: одна колонка, новая страница по заполнении"""
+    register_pdf_font()
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+    width, height = A4
+    y = height - PDF_MARGIN
+    pdf.setFont('ShoppingListFont', PDF_FONT_SIZE + 4)
+    pdf.drawString(PDF_MARGIN, y, 'Список покупок')
+    y -= PDF_LINE_HEIGHT * 2
+    pdf.setFont('ShoppingListFont', PDF_FONT_SIZE)
+    for line in shopping_list_txt(ingredients):
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            pdf.setFont('ShoppingListFont', PDF_FONT_SIZE)
+            y = height - PDF_MARGIN
+        pdf.drawString(PDF_MARGIN, y, line.rstrip())
+        y -= PDF_LINE_HEIGHT
+    pdf.save()
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', shopping_list_txt),
+    'csv': ('text/csv; charset=utf-8', shopping_list_csv),
+    'pdf': ('application/pdf', shopping_list_pdf),
+}
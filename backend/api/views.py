@@ -1,50 +1,96 @@
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import (
+    BooleanField,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Value,
+    prefetch_related_objects
+)
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from recipes.models import (
     FavoriteRecipes,
     Ingredient,
-    IngredientRecipe,
     Recipe,
     ShoppingCart,
+    ShoppingListItem,
     Tag
 )
+from recipes.relations import (
+    add,
+    bulk_add,
+    bulk_remove,
+    remove,
+    subscribe,
+    unsubscribe
+)
 from users.models import Subscription
 
+from .cache import VersionedResponseCacheMixin
 from .filters import IngredientFilter, RecipeFilter
+from .pagination import (
+    LimitPageNumberPagination,
+    PageNumberOrCursorPagination
+)
 from .permissions import IsAuthorOrReadOnly
+from .search import ingredient_index, pantry_index
 from .serializers import (
     IngredientsSerializer,
+    PantryRecipeSerializer,
+    PantrySerializer,
     RecipeCreateSerializer,
     RecipeFollowSerializer,
+    RecipeIdsSerializer,
     RecipesSerializer,
     SetPasswordSerializer,
+    ShoppingListSerializer,
     SubscriptionSerializer,
     TagSerializer,
     UserCreateSerializer,
     UserSerializer
 )
-from .utils import get_ingredients_for_file
+from .utils import SHOPPING_LIST_FORMATS
 
 User = get_user_model()
 
+RELATION_ERRORS = {
+    FavoriteRecipes: ('Рецепт уже в избранном', 'Рецепта нет в избранном'),
+    ShoppingCart: (
+        'Рецепт уже в списке покупок', 'Рецепта нет в списке покупок'),
+}
+
 
 class UsersViewSet(viewsets.ModelViewSet):
     """Представление для пользователей, работа со всеми эндпойнтами users/"""
     queryset = User.objects.all()
     permission_classes = (IsAuthenticated,)
+    pagination_class = PageNumberOrCursorPagination
+    lookup_value_regex = r'\d+'
 
     def get_permissions(self):
         if self.action == 'create':
             return (AllowAny(),)
         return super().get_permissions()
 
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return User.objects.annotate(is_subscribed=Exists(
+                Subscription.objects.filter(
+                    user=self.request.user, author=OuterRef('pk')))
+            ).order_by('id')
+        return super().get_queryset()
+
     def get_serializer_class(self):
         if self.action == 'create':
             return UserCreateSerializer
@@ -64,18 +110,35 @@ class UsersViewSet(viewsets.ModelViewSet):
     @action(methods=['post'], detail=False,
             permission_classes=(IsAuthenticated,))
     def set_password(self, request):
+        current_user = self.request.user
+        current_user.refresh_from_db(fields=('password',))
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        current_user = self.request.user
         current_user.set_password(serializer.data["new_password"])
-        current_user.save()
+        current_user.save(update_fields=('password',))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def get_subscription_authors(self):
+        return User.objects.annotate(
+            is_subscribed=Value(True, output_field=BooleanField()))
+
+    def prefetch_subscription_recipes(self, authors):
+        """Рецепты всех авторов страницы одним запросом,
+        не более recipes_limit на автора"""
+        recipes = Recipe.objects.filter(author__in=authors)
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit and recipes_limit.isdigit():
+            recipes = recipes.latest_per_author(int(recipes_limit))
+        prefetch_related_objects(
+            authors, Prefetch('recipes', queryset=recipes))
+
     @action(detail=False, permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
         current_user = self.request.user
-        subscriptions = User.objects.filter(follow__user=current_user)
+        subscriptions = self.get_subscription_authors().filter(
+            follow__user=current_user).order_by('id')
         pages = self.paginate_queryset(subscriptions)
+        self.prefetch_subscription_recipes(pages)
         serializer = SubscriptionSerializer(
             pages, many=True, context={'request': request})
         return self.get_paginated_response(serializer.data)
@@ -84,41 +147,60 @@ class UsersViewSet(viewsets.ModelViewSet):
             permission_classes=(IsAuthenticated,))
     def subscribe(self, request, pk):
         current_user = request.user
-        author = get_object_or_404(User, pk=pk)
+        pk = int(pk)
         if request.method == 'DELETE':
-            get_object_or_404(
-                Subscription, user=current_user, author=author).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+            if unsubscribe(current_user.pk, pk):
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(User, pk=pk)
+            return Response(
+                {'errors': 'Подписки на этого пользователя нет'},
+                status=status.HTTP_400_BAD_REQUEST)
+        author = get_object_or_404(self.get_subscription_authors(), pk=pk)
         serializer = SubscriptionSerializer(
             author,
             data=request.data,
             context={'request': request, 'author': author})
         serializer.is_valid(raise_exception=True)
-        Subscription.objects.create(user=current_user, author=author)
+        if not subscribe(current_user.pk, author.pk):
+            raise ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [
+                    SubscriptionSerializer.ALREADY_SUBSCRIBED]})
+        self.prefetch_subscription_recipes([author])
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(VersionedResponseCacheMixin,
+                         viewsets.ReadOnlyModelViewSet):
     """Представление для ингредиентов, только на чтение"""
     serializer_class = IngredientsSerializer
     queryset = Ingredient.objects.all()
     pagination_class = None
     filter_backends = (DjangoFilterBackend, filters.SearchFilter,)
     filterset_class = IngredientFilter
+    cache_models = (Ingredient,)
 
+    def filter_queryset(self, queryset):
+        name = self.request.query_params.get('name')
+        if self.action == 'list' and name is not None:
+            return ingredient_index.search(name)
+        return super().filter_queryset(queryset)
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagViewSet(VersionedResponseCacheMixin, viewsets.ReadOnlyModelViewSet):
     """Представление для тегов, только на чтение"""
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     pagination_class = None
+    cache_models = (Tag,)
 
 
 class RecipesViewSet(viewsets.ModelViewSet):
     """Представление для рецептов, работа со всеми эндпойнтами recipes/"""
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthorOrReadOnly,)
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter,)
+    pagination_class = PageNumberOrCursorPagination
+    lookup_value_regex = r'\d+'
+    filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
     def get_permissions(self):
@@ -126,47 +208,154 @@ class RecipesViewSet(viewsets.ModelViewSet):
             return (AllowAny(),)
         return super().get_permissions()
 
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.with_user_annotations(self.request.user)
+        return super().get_queryset()
+
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return RecipesSerializer
         return RecipeCreateSerializer
 
+    def toggle_relation(self, request, pk, model):
+        """Добавление или удаление одного рецепта: один INSERT … ON
+        CONFLICT DO NOTHING или DELETE … RETURNING, без записи в Recipe"""
+        already_added, not_added = RELATION_ERRORS[model]
+        pk = int(pk)
+        if request.method == 'DELETE':
+            if remove(model, request.user.pk, pk):
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(Recipe, pk=pk)
+            return Response(
+                {'errors': not_added}, status=status.HTTP_400_BAD_REQUEST)
+        recipe = get_object_or_404(Recipe.objects.only(
+            'name', 'image', 'image_derivatives', 'cooking_time'), pk=pk)
+        if not add(model, request.user.pk, recipe.pk):
+            return Response(
+                {'errors': already_added},
+                status=status.HTTP_400_BAD_REQUEST)
+        serializer = RecipeFollowSerializer(
+            recipe, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(methods=['post', 'delete'], detail=True,
             permission_classes=(IsAuthenticated,))
     def favorite(self, request, pk):
-        current_user = request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-        if request.method == 'DELETE':
-            get_object_or_404(
-                FavoriteRecipes, user=current_user, recipe=recipe).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        serializer = RecipeFollowSerializer(recipe, data=request.data)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        FavoriteRecipes.objects.create(user=current_user, recipe=recipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return self.toggle_relation(request, pk, FavoriteRecipes)
 
     @action(methods=['post', 'delete'], detail=True,
             permission_classes=(IsAuthenticated,))
     def shopping_cart(self, request, pk):
-        current_user = request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-        if request.method == 'DELETE':
-            get_object_or_404(
-                ShoppingCart, user=current_user, recipe=recipe).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        serializer = RecipeFollowSerializer(recipe, data=request.data)
+        return self.toggle_relation(request, pk, ShoppingCart)
+
+    def bulk_relation(self, request, model):
+        """Пакетное добавление или удаление рецептов: результат для
+        каждого id строится по строкам, которые запись действительно
+        вставила или удалила"""
+        serializer = RecipeIdsSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        ShoppingCart.objects.create(user=current_user, recipe=recipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        recipe_ids = serializer.validated_data['recipes']
+        with transaction.atomic():
+            found = set(Recipe.objects.filter(
+                pk__in=recipe_ids).values_list('pk', flat=True))
+            if request.method == 'DELETE':
+                done = set(bulk_remove(model, request.user.pk, recipe_ids))
+                outcomes = ('removed', 'not_in_list')
+            else:
+                done = set(bulk_add(model, request.user.pk, recipe_ids))
+                outcomes = ('added', 'already_in_list')
+        return Response({'results': [
+            {'id': pk,
+             'status': 'not_found' if pk not in found
+             else outcomes[0] if pk in done else outcomes[1]}
+            for pk in recipe_ids]})
+
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='favorite/bulk', url_name='favorite-bulk',
+            permission_classes=(IsAuthenticated,))
+    def favorite_bulk(self, request):
+        return self.bulk_relation(request, FavoriteRecipes)
+
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='shopping_cart/bulk', url_name='shopping-cart-bulk',
+            permission_classes=(IsAuthenticated,))
+    def shopping_cart_bulk(self, request):
+        return self.bulk_relation(request, ShoppingCart)
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        recipes = Recipe.objects.with_user_annotations(
+            request.user).feed_for(request.user)
+        page = self.paginate_queryset(recipes)
+        serializer = RecipesSerializer(
+            page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, permission_classes=(AllowAny,),
+            pagination_class=LimitPageNumberPagination)
+    def pantry(self, request):
+        """Рецепты, для которых есть хотя бы один из переданных
+        ингредиентов: сначала те, где недостающих меньше всего"""
+        params = PantrySerializer(data={
+            **request.query_params.dict(),
+            'ingredients': request.query_params.getlist('ingredients')})
+        params.is_valid(raise_exception=True)
+        recipe_ids, missing = pantry_index.rank(
+            params.validated_data['ingredients'],
+            params.validated_data.get('max_missing'))
+        page = self.paginate_queryset(range(len(recipe_ids)))
+        positions = {
+            recipe_id: position for position, recipe_id in zip(
+                page, recipe_ids[page].tolist())}
+        recipes = sorted(
+            Recipe.objects.with_user_annotations(request.user).filter(
+                pk__in=positions),
+            key=lambda recipe: positions[recipe.pk])
+        for recipe in recipes:
+            recipe.missing_ingredients = int(
+                missing[positions[recipe.pk]])
+        serializer = PantryRecipeSerializer(
+            recipes, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, permission_classes=(AllowAny,))
+    def similar(self, request, pk):
+        recipe = get_object_or_404(Recipe, pk=pk)
+        recipes = Recipe.objects.filter(
+            neighbor_of__recipe=recipe).order_by('-neighbor_of__score', 'id')
+        serializer = RecipeFollowSerializer(
+            recipes, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def shopping_list(self, request):
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by('ingredient__name')
+        return Response(ShoppingListSerializer(items, many=True).data)
 
     @action(detail=False, permission_classes=(IsAuthenticated,))
     def download_shopping_cart(self, request):
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__shopping_recipes__user=request.user)
-        response = HttpResponse(
-            get_ingredients_for_file(ingredients), headers={
-                'Content-Type': 'text/plain',
-                'Content-Disposition': 'attachment', })
-        return response
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'file_format': 'Доступные форматы: '
+                 + ', '.join(SHOPPING_LIST_FORMATS)},
+                status=status.HTTP_400_BAD_REQUEST)
+        content_type, writer = SHOPPING_LIST_FORMATS[file_format]
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
+        ).values(
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+            total_amount=F('amount')
+        ).order_by('name')
+        # Строки выбираются здесь: под ASGI потоковое тело читается
+        # в event loop, где запросы к базе запрещены
+        return StreamingHttpResponse(
+            writer(list(ingredients)),
+            headers={
+                'Content-Type': content_type,
+                'Content-Disposition':
+                    f'attachment; filename="shopping_list.{file_format}"'})
@@ -0,0 +1,36 @@
+from django.db.backends.postgresql import base, creation
+
+from .pool import dispose_pools, get_pool
+from .profiling import record_query
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        dispose_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL, берущий соединения из пула процесса вместо открытия
+    нового на каждый запрос"""
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.execute_wrappers.append(record_query)
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(
+            self.settings_dict,
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params))
+        connection = pool.checkout()
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                get_pool(self.settings_dict, None).checkin(
+                    self.connection, suspect=self.errors_occurred)
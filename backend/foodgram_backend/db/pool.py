@@ -0,0 +1,219 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+logger = logging.getLogger(__name__)
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class PooledConnection:
+    """Соединение в пуле вместе с временем создания и возврата"""
+    __slots__ = ('connection', 'created', 'returned')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.returned = time.monotonic()
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений psycopg2 с запасом сверх размера,
+    проверкой соединений при выдаче и счётчиками для подбора размера"""
+
+    def __init__(self, connect, size=10, max_overflow=10, timeout=30,
+                 recycle=1800, ping_interval=10):
+        self.connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self.idle = deque()
+        self.checked_out = {}
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self.discarded = 0
+        self.peak = 0
+
+    @property
+    def total(self):
+        return len(self.idle) + len(self.checked_out) + self.pending
+
+    def reserve(self, started):
+        """Берёт свободное соединение или место под новое, ожидая не
+        дольше timeout; вызывается под блокировкой"""
+        while True:
+            if self.idle:
+                return self.idle.pop()
+            if self.total < self.size + self.max_overflow:
+                return None
+            remaining = started + self.timeout - time.monotonic()
+            if remaining <= 0 or not self.condition.wait(remaining):
+                self.timeouts += 1
+                logger.warning(
+                    'Пул соединений исчерпан: %s занято', self.total)
+                raise OperationalError(
+                    'Не дождались свободного соединения с БД '
+                    f'за {self.timeout} с.')
+
+    def checkout(self):
+        started = time.monotonic()
+        with self.condition:
+            item = self.reserve(started)
+            self.pending += 1
+        waited = time.monotonic() - started
+        try:
+            if item is not None and not self.is_healthy(item):
+                self.discard(item)
+                item = None
+            if item is None:
+                item = PooledConnection(self.connect())
+        finally:
+            with self.condition:
+                self.pending -= 1
+                if item is None:
+                    self.condition.notify()
+                else:
+                    self.checked_out[id(item.connection)] = item
+                    self.record_checkout(waited)
+        return item.connection
+
+    def record_checkout(self, waited):
+        self.checkouts += 1
+        self.peak = max(self.peak, len(self.checked_out))
+        if waited > 0.001:
+            self.waits += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+
+    def checkin(self, connection, suspect=False):
+        with self.condition:
+            item = self.checked_out.pop(id(connection), None)
+        if item is None:
+            connection.close()
+            return
+        if not self.reset(item, ping=suspect):
+            self.discard(item)
+            return
+        with self.condition:
+            if len(self.idle) + len(self.checked_out) >= self.size:
+                overflow = True
+            else:
+                overflow = False
+                item.returned = time.monotonic()
+                self.idle.append(item)
+            self.condition.notify()
+        if overflow:
+            item.connection.close()
+
+    def is_healthy(self, item):
+        connection = item.connection
+        now = time.monotonic()
+        if connection.closed or now - item.created > self.recycle:
+            return False
+        if now - item.returned < self.ping_interval:
+            return True
+        return self.ping(connection)
+
+    def reset(self, item, ping=False):
+        """Откатывает незавершённую транзакцию перед возвратом в пул"""
+        connection = item.connection
+        if connection.closed:
+            return False
+        try:
+            if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except Exception:
+            return False
+        return not ping or self.ping(connection)
+
+    @staticmethod
+    def ping(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except Exception:
+            return False
+        return True
+
+    def discard(self, item):
+        with self.condition:
+            self.discarded += 1
+            self.condition.notify()
+        try:
+            item.connection.close()
+        except Exception:
+            pass
+
+    def dispose(self):
+        """Закрывает все свободные соединения"""
+        with self.condition:
+            items, self.idle = list(self.idle), deque()
+        for item in items:
+            item.connection.close()
+
+    def stats(self):
+        with self.condition:
+            in_use = len(self.checked_out)
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'idle': len(self.idle),
+                'in_use': in_use,
+                'peak_in_use': self.peak,
+                'saturation': round(in_use / self.size, 3),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time_total': round(self.wait_time, 6),
+                'wait_time_max': round(self.max_wait_time, 6),
+                'timeouts': self.timeouts,
+                'discarded': self.discarded,
+            }
+
+
+def get_pool(settings_dict, connect):
+    """Пул для базы из settings_dict; после fork процесс заводит свой"""
+    key = (
+        os.getpid(), settings_dict['HOST'], settings_dict['PORT'],
+        settings_dict['NAME'], settings_dict['USER'])
+    pool = pools.get(key)
+    if pool is None:
+        with pools_lock:
+            pool = pools.get(key)
+            if pool is None:
+                options = settings_dict.get('POOL', {})
+                pool = pools[key] = ConnectionPool(
+                    connect,
+                    size=options.get('SIZE', 10),
+                    max_overflow=options.get('MAX_OVERFLOW', 10),
+                    timeout=options.get('TIMEOUT', 30),
+                    recycle=options.get('RECYCLE', 1800),
+                    ping_interval=options.get('PING_INTERVAL', 10))
+    return pool
+
+
+def dispose_pools(name=None):
+    for key, pool in list(pools.items()):
+        if name is None or key[3] == name:
+            pool.dispose()
+
+
+def pool_stats():
+    pid = os.getpid()
+    return {
+        f'{host or "local"}:{port or ""}/{name}': pool.stats()
+        for (owner, host, port, name, user), pool in pools.items()
+        if owner == pid}
@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+NUMBER = re.compile(r'\b\d+\b')
+
+action_stats = {}
+action_stats_lock = threading.Lock()
+
+# Профилировщик текущего HTTP-запроса; sync_to_async переносит контекст
+# в свои потоки, поэтому запросы view в пуле тоже попадают в него
+current_recorder = ContextVar('sql_profile_recorder', default=None)
+
+
+def statement_shape(sql):
+    """SQL без значений: списки IN и числа заменены заглушками"""
+    return NUMBER.sub('N', PLACEHOLDER_LIST.sub('(...)', sql))
+
+
+class QueryRecorder:
+    """execute_wrapper, считающий запросы, их время и одинаковые формы"""
+
+    def __init__(self, slowest):
+        self.slowest_size = slowest
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            self.shapes[statement_shape(sql)] += 1
+            item = (duration, self.count, sql)
+            if len(self.slowest) < self.slowest_size:
+                heapq.heappush(self.slowest, item)
+            else:
+                heapq.heappushpop(self.slowest, item)
+
+    def repeated(self):
+        return [
+            {'count': count, 'sql': shape}
+            for shape, count in self.shapes.most_common()
+            if count >= settings.SQL_PROFILE_REPEAT_THRESHOLD]
+
+
+def view_name(view_func, method):
+    """Имя DRF-действия вида RecipesViewSet.list или путь к функции"""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__qualname__}'
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method.lower(), method)}'
+
+
+def record_action(name, recorder, over_budget):
+    with action_stats_lock:
+        stats = action_stats.setdefault(name, {
+            'requests': 0, 'queries': 0, 'max_queries': 0,
+            'sql_time': 0.0, 'over_budget': 0})
+        stats['requests'] += 1
+        stats['queries'] += recorder.count
+        stats['max_queries'] = max(stats['max_queries'], recorder.count)
+        stats['sql_time'] += recorder.duration
+        stats['over_budget'] += over_budget
+
+
+def profile_stats():
+    with action_stats_lock:
+        return {
+            name: dict(
+                stats,
+                avg_queries=round(stats['queries'] / stats['requests'], 2),
+                sql_time=round(stats['sql_time'], 6))
+            for name, stats in sorted(action_stats.items())}
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper всех соединений (см. db.base): передаёт запрос
+    профилировщику текущего HTTP-запроса, если тот профилируется"""
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+class QueryProfileMiddleware:
+    """Профилирует SQL выборки запросов: включается настройкой
+    SQL_PROFILE_SAMPLE_RATE или заголовком X-SQL-Profile от сотрудника
+    (или от любого клиента при SQL_PROFILE_HEADER_ENABLED)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        if not (self.is_sampled(request) or (
+                self.wants_profile(request)
+                and self.header_allowed(request))):
+            return self.get_response(request)
+        recorder = QueryRecorder(settings.SQL_PROFILE_SLOWEST)
+        token = current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.report(request, response, recorder, started)
+        return response
+
+    async def acall(self, request):
+        """Под ASGI цепочка остаётся асинхронной: синхронный middleware
+        перевёл бы каждый запрос в общий поток и лишил чтения
+        параллельности"""
+        if not (self.is_sampled(request) or (
+                self.wants_profile(request)
+                and await sync_to_async(self.header_allowed)(request))):
+            return await self.get_response(request)
+        recorder = QueryRecorder(settings.SQL_PROFILE_SLOWEST)
+        token = current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.report(request, response, recorder, started)
+        return response
+
+    @staticmethod
+    def is_sampled(request):
+        rate = settings.SQL_PROFILE_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    @staticmethod
+    def wants_profile(request):
+        return bool(request.META.get('HTTP_X_SQL_PROFILE'))
+
+    @staticmethod
+    def header_allowed(request):
+        return settings.SQL_PROFILE_HEADER_ENABLED or request.user.is_staff
+
+    def report(self, request, response, recorder, started):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        name = (
+            view_name(match.func, request.method) if match else request.path)
+        over_budget = recorder.count > settings.SQL_QUERY_BUDGET
+        record_action(name, recorder, over_budget)
+        response['Server-Timing'] = (
+            f'sql;dur={recorder.duration * 1000:.1f};'
+            f'desc="{recorder.count} queries", '
+            f'app;dur={elapsed * 1000:.1f}')
+        line = {
+            'view': name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'sql_ms': round(recorder.duration * 1000, 2),
+            'total_ms': round(elapsed * 1000, 2),
+            'slowest': [
+                {'ms': round(duration * 1000, 2), 'sql': sql}
+                for duration, _, sql in sorted(recorder.slowest, reverse=True)
+            ],
+            'repeated': recorder.repeated(),
+        }
+        logger.info('sql_profile %s', json.dumps(line, ensure_ascii=False))
+        if over_budget:
+            logger.warning(
+                '%s: %s SQL-запросов при бюджете %s',
+                name, recorder.count, settings.SQL_QUERY_BUDGET)
@@ -0,0 +1,17 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from .pool import pool_stats
+from .profiling import profile_stats
+
+
+@staff_member_required
+def db_pool_stats(request):
+    """Счётчики пула соединений текущего процесса"""
+    return JsonResponse(pool_stats())
+
+
+@staff_member_required
+def sql_profile_stats(request):
+    """SQL-запросы по DRF-действиям для профилированных запросов процесса"""
+    return JsonResponse(profile_stats())
@@ -1,5 +1,6 @@
 # flake8: noqa
 import os
+from datetime import timedelta
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -21,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     # installed apps:
     'rest_framework',
     'rest_framework.authtoken',
@@ -37,9 +39,9 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'foodgram_backend.db.profiling.QueryProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-
 ]
 
 ROOT_URLCONF = 'foodgram_backend.urls'
@@ -68,12 +70,30 @@ WSGI_APPLICATION = 'foodgram_backend.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'foodgram_backend.db',
         'NAME': os.getenv('POSTGRES_DB', 'food'),
         'USER': os.getenv('POSTGRES_USER', 'postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', 'localhost'),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        # Пул соединений на процесс, см. foodgram_backend/db/pool.py
+        'POOL': {
+            'SIZE': int(os.getenv('DB_POOL_SIZE', 10)),
+            'MAX_OVERFLOW': int(os.getenv('DB_POOL_MAX_OVERFLOW', 10)),
+            'TIMEOUT': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+            'RECYCLE': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+            'PING_INTERVAL': int(os.getenv('DB_POOL_PING_INTERVAL', 10)),
+        },
+    }
+}
+
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', '/tmp/foodgram_cache'),
     }
 }
 
@@ -122,10 +142,38 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Доля запросов с профилированием SQL; заголовок X-SQL-Profile включает его
+# для отдельного запроса сотрудника, а с SQL_PROFILE_HEADER_ENABLED — любого
+SQL_PROFILE_SAMPLE_RATE = float(os.getenv('SQL_PROFILE_SAMPLE_RATE', 0))
+SQL_PROFILE_HEADER_ENABLED = os.getenv(
+    'SQL_PROFILE_HEADER_ENABLED', 'false').lower() == 'true'
+SQL_PROFILE_SLOWEST = 5
+SQL_PROFILE_REPEAT_THRESHOLD = 3
+SQL_QUERY_BUDGET = int(os.getenv('SQL_QUERY_BUDGET', 15))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'foodgram_backend.db': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Подписанные токены (/api/auth/jwt/create/) проверяются без запросов к БД
+STATELESS_AUTH = os.getenv('STATELESS_AUTH', 'false').lower() == 'true'
+
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 60))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-
+        ('api.authentication.StatelessTokenAuthentication',)
+        if STATELESS_AUTH else ()
+    ) + (
+        'api.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -140,9 +188,44 @@ DJOSER = {
     'LOGIN_FIELD': 'email',
 }
 
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(
+        minutes=int(os.getenv('STATELESS_TOKEN_LIFETIME', 15))),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER':
+        'api.authentication.StatelessTokenObtainSerializer',
+}
+
 FILE_PATH = Path(BASE_DIR/ 'data/ingredients.json')
 FILE_PATH_TAGS = Path(BASE_DIR/ 'data/tags.json')
 FILE_PATH_USERS = Path(BASE_DIR/ 'data/users.json')
+FILE_PATH_RECIPES = Path(BASE_DIR/ 'data/recipes.json')
+
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+IMAGE_DERIVATIVE_FORMAT = os.getenv('IMAGE_DERIVATIVE_FORMAT', 'webp')
+
+# Лента подписок: длина ленты, размер пачки рассылки и порог подписчиков,
+# после которого рецепты автора читаются при запросе ленты
+FEED_MAX_LENGTH = int(os.getenv('FEED_MAX_LENGTH', 500))
+FEED_FANOUT_BATCH_SIZE = int(os.getenv('FEED_FANOUT_BATCH_SIZE', 1000))
+FEED_HOT_AUTHOR_FOLLOWERS = int(os.getenv('FEED_HOT_AUTHOR_FOLLOWERS', 10000))
+FEED_WORKERS = int(os.getenv('FEED_WORKERS', 2))
+
+# Похожие рецепты: длина списка соседей, вес тегов в оценке, порог, после
+# которого ингредиент считается слишком частым, и размер пачки расчёта
+SIMILAR_RECIPES_TOP_K = int(os.getenv('SIMILAR_RECIPES_TOP_K', 20))
+SIMILAR_RECIPES_TAG_WEIGHT = float(os.getenv('SIMILAR_RECIPES_TAG_WEIGHT', 0.2))
+SIMILAR_RECIPES_MAX_POSTINGS = int(
+    os.getenv('SIMILAR_RECIPES_MAX_POSTINGS', 5000))
+SIMILAR_RECIPES_BATCH_SIZE = int(os.getenv('SIMILAR_RECIPES_BATCH_SIZE', 256))
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# Под ASGI-сервером горячие GET-эндпоинты выполняются в отдельном пуле
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'false').lower() == 'true'
+ASYNC_READ_WORKERS = int(os.getenv('ASYNC_READ_WORKERS', 16))
 
 
 
@@ -3,8 +3,11 @@ from django.contrib import admin
 from django.urls import include, path
 
 from . import settings
+from .db.views import db_pool_stats, sql_profile_stats
 
 urlpatterns = [
+    path('admin/db-pool/', db_pool_stats),
+    path('admin/sql-profile/', sql_profile_stats),
     path('admin/', admin.site.urls),
     path('api/', include('api.urls'))
 ]
@@ -2,18 +2,25 @@ from django.contrib import admin
 from django.utils.safestring import mark_safe
 
 from . import models
+from .paginators import EstimatedCountPaginator
 
 
 class IngredientRecipeInLine(admin.TabularInline):
     model = models.IngredientRecipe
     extra = 1
+    autocomplete_fields = ('ingredients',)
 
 
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (IngredientRecipeInLine,)
     list_display = ('name', 'author', 'get_html_image', 'get_favorite_amount')
     list_display_links = ('name', 'author', 'get_html_image',)
-    list_filter = ('author', 'name', 'tags')
+    list_filter = ('tags',)
+    list_select_related = ('author',)
+    search_fields = ('name', 'author__username')
+    autocomplete_fields = ('author',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     save_on_top = True
 
     def get_html_image(self, object):
@@ -22,24 +29,45 @@ class RecipeAdmin(admin.ModelAdmin):
     get_html_image.short_description = 'Фотофуд'  # type: ignore
 
     def get_favorite_amount(self, object):
-        return models.FavoriteRecipes.objects.filter(recipe=object).count()
+        return object.favorites_count
 
     get_favorite_amount.short_description = 'В избранном'  # type: ignore
+    get_favorite_amount.admin_order_field = 'favorites_count'  # type: ignore
 
 
 class IngredientAdmin(admin.ModelAdmin):
-    inlines = (IngredientRecipeInLine,)
     list_display = ('name', 'measurement_unit')
-    list_filter = ('name',)
     search_fields = ('^name',)
+    readonly_fields = ('get_recipes_amount',)
+
+    def get_recipes_amount(self, object):
+        return object.ingredients.count()
+
+    get_recipes_amount.short_description = 'В рецептах'  # type: ignore
+
+
+class IngredientRecipeAdmin(admin.ModelAdmin):
+    list_display = ('recipe', 'ingredients', 'amount')
+    list_select_related = ('recipe__author', 'ingredients')
+    autocomplete_fields = ('recipe', 'ingredients')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class UserRecipeAdmin(admin.ModelAdmin):
+    list_display = ('user', 'recipe')
+    list_select_related = ('user', 'recipe__author')
+    autocomplete_fields = ('user', 'recipe')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 admin.site.register(models.Recipe, RecipeAdmin)
 admin.site.register(models.Ingredient, IngredientAdmin)
 admin.site.register(models.Tag)
-admin.site.register(models.FavoriteRecipes)
-admin.site.register(models.IngredientRecipe)
-admin.site.register(models.ShoppingCart)
+admin.site.register(models.FavoriteRecipes, UserRecipeAdmin)
+admin.site.register(models.IngredientRecipe, IngredientRecipeAdmin)
+admin.site.register(models.ShoppingCart, UserRecipeAdmin)
 
 admin.site.site_title = 'Админка сайта FOODGRAM'
 admin.site.site_header = 'Админка сайта FOODGRAM'
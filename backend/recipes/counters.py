@@ -0,0 +1,50 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import Subscription
+
+from .models import FavoriteRecipes, Recipe, ShoppingCart
+
+
+def count_by(model, field):
+    """Подзапрос: число строк model, ссылающихся на текущую запись"""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')), 0)
+
+
+def repair(queryset, counters):
+    """Исправляет расхождения счётчиков с фактическими данными,
+    возвращает число исправленных строк"""
+    mismatch = Q()
+    for field, actual in counters.items():
+        mismatch |= ~Q(**{field: F(f'actual_{field}')})
+    return queryset.annotate(**{
+        f'actual_{field}': actual for field, actual in counters.items()
+    }).filter(mismatch).update(**counters)
+
+
+def repair_recipes(queryset):
+    return repair(queryset, {
+        'favorites_count': count_by(FavoriteRecipes, 'recipe'),
+        'in_carts_count': count_by(ShoppingCart, 'recipe'),
+    })
+
+
+def repair_users(queryset):
+    return repair(queryset, {
+        'recipes_count': count_by(Recipe, 'author'),
+        'followers_count': count_by(Subscription, 'author'),
+    })
+
+
+def increment(model, pk, field, delta):
+    """Атомарно сдвигает счётчик на delta прямо в базе"""
+    return model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
+
+def increment_many(model, pks, field, delta):
+    """То же для нескольких записей одним UPDATE"""
+    return model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, 0)})
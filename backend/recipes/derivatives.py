@@ -0,0 +1,91 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANTS = {
+    'thumbnail': (240, 240),
+    'card': (600, 600),
+    'full': (1600, 1600),
+}
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DERIVATIVES_DIR = 'recipes/images/derivatives'
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+    thread_name_prefix='image-derivatives')
+
+
+def derivative_paths(derivatives):
+    return {
+        path for formats in derivatives.values() for path in formats.values()}
+
+
+def delete_derivatives(storage, derivatives, keep=()):
+    """Удаляет файлы копий, кроме путей из keep"""
+    for path in derivative_paths(derivatives) - set(keep):
+        storage.delete(path)
+
+
+def build_derivatives(recipe_id):
+    """Сохраняет уменьшенные копии картинки рецепта во всех форматах,
+    записывает их пути в Recipe.image_derivatives и удаляет прежние копии.
+    Если картинку успели сменить, удаляются только что сохранённые"""
+    recipe = Recipe.objects.only('image', 'image_derivatives').get(
+        pk=recipe_id)
+    storage = recipe.image.storage
+    stem = os.path.splitext(os.path.basename(recipe.image.name))[0]
+    with recipe.image.open('rb') as source:
+        original = ImageOps.exif_transpose(Image.open(source))
+        original = original.convert('RGB')
+    derivatives = {}
+    for variant, size in IMAGE_VARIANTS.items():
+        image = original.copy()
+        image.thumbnail(size, Image.LANCZOS)
+        derivatives[variant] = {}
+        for extension, (image_format, options) in IMAGE_FORMATS.items():
+            buffer = io.BytesIO()
+            image.save(buffer, image_format, **options)
+            derivatives[variant][extension] = storage.save(
+                f'{DERIVATIVES_DIR}/{stem}_{variant}.{extension}',
+                ContentFile(buffer.getvalue()))
+    if Recipe.objects.filter(pk=recipe_id, image=recipe.image.name).update(
+            image_derivatives=derivatives):
+        delete_derivatives(
+            storage, recipe.image_derivatives, derivative_paths(derivatives))
+        return derivatives
+    delete_derivatives(storage, derivatives)
+    return {}
+
+
+def run_build_derivatives(recipe_id, replaced=None):
+    """Возвращает пути копий или None, если подготовить их не удалось;
+    replaced — копии прежней картинки, которые больше не нужны"""
+    close_old_connections()
+    try:
+        return build_derivatives(recipe_id)
+    except Exception:
+        logger.exception(
+            'Не удалось подготовить картинки рецепта %s', recipe_id)
+        return None
+    finally:
+        if replaced:
+            delete_derivatives(Recipe.image.field.storage, replaced)
+        close_old_connections()
+
+
+def schedule_derivatives(recipe_id, replaced=None):
+    """Ставит подготовку картинок в фоновый пул, не задерживая запрос"""
+    return executor.submit(run_build_derivatives, recipe_id, replaced)
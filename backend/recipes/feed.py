@@ -0,0 +1,110 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from users.models import Subscription, User
+
+from .models import FeedEntry, Recipe
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.FEED_WORKERS, thread_name_prefix='feed')
+
+BACKFILL_SQL = f'''
+    INSERT INTO {FeedEntry._meta.db_table} (user_id, recipe_id, author_id)
+    SELECT subscription.user_id, recipe.id, recipe.author_id
+    FROM {Subscription._meta.db_table} AS subscription
+    JOIN {User._meta.db_table} AS author
+        ON author.id = subscription.author_id
+        AND author.followers_count < %(hot)s
+    CROSS JOIN LATERAL (
+        SELECT id, author_id FROM {Recipe._meta.db_table}
+        WHERE author_id = subscription.author_id
+        ORDER BY id DESC LIMIT %(limit)s
+    ) AS recipe
+    WHERE subscription.user_id = ANY(%(users)s)
+        AND (%(author)s::bigint IS NULL OR subscription.author_id = %(author)s)
+    ON CONFLICT DO NOTHING
+'''
+
+
+def is_hot(followers_count):
+    """Рецепты авторов с огромным числом подписчиков читаются в момент
+    запроса ленты, а не рассылаются по лентам"""
+    return followers_count >= settings.FEED_HOT_AUTHOR_FOLLOWERS
+
+
+def trim_feeds(user_ids):
+    """Оставляет в лентах только FEED_MAX_LENGTH новейших записей"""
+    ranked = FeedEntry.objects.filter(user_id__in=user_ids).annotate(
+        position=Window(
+            expression=RowNumber(),
+            partition_by=F('user'),
+            order_by=F('recipe').desc())).values('id', 'position')
+    sql, params = ranked.query.sql_with_params()
+    return FeedEntry.objects.filter(pk__in=RawSQL(
+        f'SELECT id FROM ({sql}) AS ranked WHERE position > %s',
+        (*params, settings.FEED_MAX_LENGTH))).delete()
+
+
+def backfill(user_ids, author_id=None):
+    """Заполняет ленты последними рецептами авторов, на которых
+    подписаны пользователи (или одного author_id)"""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(BACKFILL_SQL, {
+                'hot': settings.FEED_HOT_AUTHOR_FOLLOWERS,
+                'limit': settings.FEED_MAX_LENGTH,
+                'users': list(user_ids),
+                'author': author_id})
+        trim_feeds(user_ids)
+
+
+def fan_out(recipe_id):
+    """Добавляет новый рецепт в ленты подписчиков автора пачками"""
+    recipe = Recipe.objects.filter(pk=recipe_id).values(
+        'author_id', 'author__followers_count').first()
+    if recipe is None or is_hot(recipe['author__followers_count']):
+        return
+    followers = Subscription.objects.filter(
+        author_id=recipe['author_id']
+    ).order_by('user_id').values_list('user_id', flat=True).iterator()
+    while batch := list(islice(followers, settings.FEED_FANOUT_BATCH_SIZE)):
+        with transaction.atomic():
+            FeedEntry.objects.bulk_create([
+                FeedEntry(
+                    user_id=user_id, recipe_id=recipe_id,
+                    author_id=recipe['author_id'])
+                for user_id in batch], ignore_conflicts=True)
+            trim_feeds(batch)
+
+
+def unfollow(user_id, author_id):
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def run_in_background(function, *args):
+    close_old_connections()
+    try:
+        function(*args)
+    except Exception:
+        logger.exception('Не удалось обновить ленты: %s%s', function, args)
+    finally:
+        close_old_connections()
+
+
+def schedule_fan_out(recipe_id):
+    """Рассылает рецепт по лентам в фоновом пуле, не задерживая запрос"""
+    return executor.submit(run_in_background, fan_out, recipe_id)
+
+
+def schedule_backfill(user_id, author_id=None):
+    return executor.submit(
+        run_in_background, backfill, [user_id], author_id)
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import math
+import random
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from asgiref.testing import ApplicationCommunicator
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.db.models import Count
+from django.test import Client, override_settings
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+SCENARIOS = {
+    'recipe_list': (
+        False, lambda rng, data: (
+            f'/api/recipes/?page={rng.randint(1, 5)}&limit=6')),
+    'recipe_list_filtered': (
+        True, lambda rng, data: (
+            f'/api/recipes/?tags={rng.choice(data["tags"])}'
+            f'&is_favorited={rng.randint(0, 1)}&limit=6')),
+    'recipe_search': (
+        False, lambda rng, data: (
+            f'/api/recipes/?search={rng.choice(data["words"])}&limit=6')),
+    'recipe_detail': (
+        False, lambda rng, data: (
+            f'/api/recipes/{rng.choice(data["recipes"])}/')),
+    'subscriptions': (
+        True, lambda rng, data: (
+            '/api/users/subscriptions/?recipes_limit=3&limit=6')),
+    'download_shopping_cart': (
+        True, lambda rng, data: '/api/recipes/download_shopping_cart/'),
+    'ingredient_search': (
+        False, lambda rng, data: (
+            f'/api/ingredients/?name={rng.choice(data["prefixes"])}')),
+}
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LocalTransport:
+    """Запросы прямо в приложение через тестовый клиент Django"""
+
+    def __init__(self, headers):
+        self.headers = {
+            f'HTTP_{name.upper().replace("-", "_")}': value
+            for name, value in headers.items()}
+        self.local = threading.local()
+
+    def get(self, path):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(
+                HTTP_HOST='localhost', raise_request_exception=False)
+        try:
+            response = client.get(path, **self.headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        finally:
+            # Тестовый клиент не закрывает соединения после ответа
+            close_old_connections()
+        return response.status_code, response.get('Server-Timing', '')
+
+
+class AsgiTransport:
+    """Запросы в ASGI-приложение процесса: все идут через один цикл
+    событий, как под uvicorn, и проходят всю цепочку MIDDLEWARE"""
+
+    def __init__(self, headers):
+        self.application = get_asgi_application()
+        self.headers = [
+            (name.lower().encode(), value.encode())
+            for name, value in headers.items()]
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    async def request(self, path):
+        path, _, query = path.partition('?')
+        communicator = ApplicationCommunicator(self.application, {
+            'type': 'http', 'asgi': {'version': '3.0'},
+            'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'query_string': query.encode(),
+            'headers': [(b'host', b'localhost'), *self.headers],
+            'server': ('localhost', 80)})
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(timeout=60)
+        while (await communicator.receive_output(timeout=60)).get(
+                'more_body'):
+            pass
+        headers = {name.lower(): value for name, value in start['headers']}
+        return start['status'], headers.get(b'server-timing', b'').decode()
+
+    def get(self, path):
+        return asyncio.run_coroutine_threadsafe(
+            self.request(path), self.loop).result()
+
+
+class HttpTransport:
+    """Запросы к запущенному серверу по HTTP"""
+
+    def __init__(self, base_url, headers):
+        self.base_url = base_url.rstrip('/')
+        self.headers = headers
+        self.local = threading.local()
+
+    def get(self, path):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            session.headers.update(self.headers)
+        response = session.get(self.base_url + path)
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный прогон основных эндпоинтов с отчётом в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base-url',
+            help='Адрес запущенного сервера; без него запросы идут в '
+                 'приложение напрямую. Число SQL-запросов сервер отдаёт, '
+                 'если запущен с SQL_PROFILE_HEADER_ENABLED=true')
+        parser.add_argument(
+            '--asgi', action='store_true',
+            help='Без --base-url: запросы через ASGI-приложение процесса '
+                 'с ASYNC_READ_VIEWS, чтобы проверить параллельность чтений')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument(
+            '--scenario', action='append', choices=sorted(SCENARIOS),
+            help='Запустить только указанные сценарии')
+        parser.add_argument(
+            '--user', help='Email пользователя для авторизованных запросов')
+        parser.add_argument('--token', help='Готовый токен пользователя')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='benchmark.json')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        data = self.collect_data()
+        token = options['token'] or self.get_token(options['user'])
+        if not options['base_url']:
+            # Прямые запросы профилируются по заголовку без входа сотрудника
+            override_settings(
+                SQL_PROFILE_HEADER_ENABLED=True,
+                ASYNC_READ_VIEWS=options['asgi']).enable()
+        transports = {
+            authorized: self.make_transport(options, token if authorized
+                                            else None)
+            for authorized in (False, True)}
+        results = {}
+        for name in options['scenario'] or SCENARIOS:
+            authorized, make_path = SCENARIOS[name]
+            results[name] = self.run_scenario(
+                transports[authorized], make_path, data, options)
+            self.print_result(name, results[name])
+        report = {
+            'commit': git_commit(),
+            'started': datetime.now(timezone.utc).isoformat(),
+            'base_url': options['base_url'],
+            'asgi': options['asgi'],
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'dataset': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+            },
+            'scenarios': results,
+        }
+        with open(options['output'], 'w', encoding='utf8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Результаты записаны в {options["output"]}'))
+
+    @staticmethod
+    def make_transport(options, token):
+        headers = {'X-SQL-Profile': '1'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        if options['base_url']:
+            return HttpTransport(options['base_url'], headers)
+        if options['asgi']:
+            return AsgiTransport(headers)
+        return LocalTransport(headers)
+
+    def collect_data(self):
+        recipes = list(
+            Recipe.objects.order_by('?').values_list('pk', flat=True)[:1000])
+        names = list(
+            Ingredient.objects.order_by('?').values_list(
+                'name', flat=True)[:200])
+        if not recipes or not names:
+            raise CommandError(
+                'База пуста, сначала выполните generate_data')
+        words = [
+            word for name in Recipe.objects.filter(
+                pk__in=recipes[:100]).values_list('name', flat=True)
+            for word in name.split() if len(word) > 3]
+        return {
+            'recipes': recipes,
+            'prefixes': [name[:self.rng.randint(2, 4)] for name in names],
+            'tags': list(Tag.objects.values_list('slug', flat=True)),
+            'words': words or names,
+        }
+
+    @staticmethod
+    def get_token(email):
+        users = User.objects.all()
+        if email:
+            users = users.filter(email=email)
+        user = users.annotate(
+            subscriptions=Count('follower')).order_by(
+            '-subscriptions', 'pk').first()
+        if user is None:
+            raise CommandError('Пользователь не найден')
+        return Token.objects.get_or_create(user=user)[0].key
+
+    def run_scenario(self, transport, make_path, data, options):
+        paths = [
+            make_path(self.rng, data)
+            for _ in range(options['warmup'] + options['requests'])]
+        for path in paths[:options['warmup']]:
+            transport.get(path)
+
+        def timed(path):
+            started = time.perf_counter()
+            status, timing = transport.get(path)
+            return time.perf_counter() - started, status, timing
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            samples = list(pool.map(timed, paths[options['warmup']:]))
+        return self.summarize(samples, time.perf_counter() - started)
+
+    @staticmethod
+    def summarize(samples, elapsed):
+        latencies = [duration * 1000 for duration, _, _ in samples]
+        queries = [
+            int(match.group(1)) for _, _, timing in samples
+            if (match := SERVER_TIMING_QUERIES.search(timing))]
+        return {
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'throughput_rps': round(len(samples) / elapsed, 1),
+            'errors': sum(status >= 400 for _, status, _ in samples),
+            'queries_median': percentile(queries, 50) if queries else None,
+            'queries_max': max(queries) if queries else None,
+        }
+
+    def print_result(self, name, result):
+        self.stdout.write(
+            f'{name:24} p50 {result["p50_ms"]:8.2f} мс  '
+            f'p95 {result["p95_ms"]:8.2f}  p99 {result["p99_ms"]:8.2f}  '
+            f'{result["throughput_rps"]:7.1f} rps  '
+            f'SQL {result["queries_median"]}  ошибок {result["errors"]}')
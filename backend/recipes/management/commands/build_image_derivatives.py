@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from recipes.derivatives import executor, run_build_derivatives
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Подготовка уменьшенных копий картинок рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересобрать копии и у рецептов, где они уже есть')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_derivatives={})
+        recipe_ids = list(recipes.values_list('id', flat=True))
+        failed = 0
+        results = executor.map(run_build_derivatives, recipe_ids)
+        for done, (recipe_id, derivatives) in enumerate(
+                zip(recipe_ids, results), start=1):
+            if derivatives is None:
+                failed += 1
+                self.stderr.write(
+                    f'Рецепт {recipe_id}: картинки не подготовлены')
+            if done % 100 == 0:
+                self.stdout.write(f'{done}/{len(recipe_ids)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Картинки подготовлены для {len(recipe_ids) - failed} '
+            f'рецептов, с ошибками: {failed}.'))
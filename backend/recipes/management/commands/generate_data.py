@@ -0,0 +1,205 @@
+import itertools
+import random
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from recipes import shopping_list
+from recipes.counters import repair_recipes, repair_users
+from recipes.management.commands.load_json_data import (
+    batches,
+    iter_json_array
+)
+from recipes.models import (
+    FavoriteRecipes,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag
+)
+from recipes.versions import bump_version
+from users.models import Subscription, User
+
+IMAGE_NAME = 'recipes/images/synthetic.png'
+PASSWORD = 'synthetic-password'
+
+
+def zipf_weights(size, exponent):
+    """Кумулятивные веса распределения Ципфа: первые элементы популярнее"""
+    return list(itertools.accumulate(
+        1 / (rank + 1) ** exponent for rank in range(size)))
+
+
+def sample(rng, population, cum_weights, size):
+    """size различных элементов с учётом весов"""
+    size = min(size, len(population))
+    chosen = {}
+    while len(chosen) < size:
+        for item in rng.choices(population, cum_weights=cum_weights, k=size):
+            chosen.setdefault(item, None)
+    return list(chosen)[:size]
+
+
+class Command(BaseCommand):
+    help = 'Генерация синтетических данных для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, nargs=2, default=(3, 12),
+            metavar=('MIN', 'MAX'))
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--cart-per-user', type=int, default=5)
+        parser.add_argument('--subscriptions-per-user', type=int, default=10)
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Показатель распределения популярности авторов и рецептов')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--prefix', default='synthetic',
+            help='Префикс логинов, позволяет генерировать наборы повторно')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(
+                username__startswith=f'{options["prefix"]}_').exists():
+            raise CommandError(
+                f'Набор «{options["prefix"]}» уже есть, '
+                'укажите другой --prefix')
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.load_reference_data()
+        self.ensure_image()
+        users = self.generate_users()
+        recipes = self.generate_recipes(users)
+        self.generate_relations(users, recipes)
+        bump_version(IngredientRecipe)
+        self.stdout.write('Списки покупок...')
+        shopping_list.rebuild(
+            User.objects.filter(pk__in=users).values('pk'))
+        self.stdout.write('Пересчёт счётчиков...')
+        repair_recipes(Recipe.objects.filter(pk__in=recipes))
+        repair_users(User.objects.filter(pk__in=users))
+        self.stdout.write(self.style.SUCCESS('Данные сгенерированы.'))
+
+    def report(self, label, done, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{label}: {done} записей, {done / (elapsed or 1e-9):.0f} в сек.')
+
+    def bulk_insert(self, label, model, rows):
+        started = time.monotonic()
+        done = 0
+        for batch in batches(rows, self.batch_size):
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+            done += len(batch)
+        self.report(label, done, started)
+
+    def load_reference_data(self):
+        if not Ingredient.objects.exists():
+            self.bulk_insert('Ингредиенты', Ingredient, (
+                Ingredient(**item)
+                for item in iter_json_array(settings.FILE_PATH)))
+            bump_version(Ingredient)
+        if not Tag.objects.exists():
+            self.bulk_insert('Теги', Tag, (
+                Tag(**item)
+                for item in iter_json_array(settings.FILE_PATH_TAGS)))
+            bump_version(Tag)
+        ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+        self.rng.shuffle(ingredients)
+        self.ingredients = ingredients
+        self.ingredient_weights = zipf_weights(
+            len(ingredients), self.options['zipf'])
+        self.tags = list(Tag.objects.values_list('pk', flat=True))
+
+    def ensure_image(self):
+        if default_storage.exists(IMAGE_NAME):
+            return
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), (200, 120, 60)).save(buffer, 'PNG')
+        default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+
+    def generate_users(self):
+        prefix = self.options['prefix']
+        password = make_password(PASSWORD)
+        self.bulk_insert('Пользователи', User, (
+            User(
+                username=f'{prefix}_{number}',
+                email=f'{prefix}_{number}@example.com',
+                first_name=f'Имя {number}',
+                last_name=f'Фамилия {number}',
+                password=password)
+            for number in range(self.options['users'])))
+        return list(User.objects.filter(
+            username__startswith=f'{prefix}_').values_list('pk', flat=True))
+
+    def generate_recipes(self, users):
+        author_weights = zipf_weights(len(users), self.options['zipf'])
+        prefix = self.options['prefix']
+        started = time.monotonic()
+        count = self.options['recipes']
+        for numbers in batches(range(count), self.batch_size):
+            authors = self.rng.choices(
+                users, cum_weights=author_weights, k=len(numbers))
+            with transaction.atomic():
+                self.create_recipes(
+                    [(number, author) for number, author in zip(
+                        numbers, authors)], prefix)
+        self.report('Рецепты', count, started)
+        return list(Recipe.objects.filter(
+            author__in=users).values_list('pk', flat=True))
+
+    def create_recipes(self, items, prefix):
+        rng = self.rng
+        low, high = self.options['ingredients_per_recipe']
+        recipes = Recipe.objects.bulk_create([
+            Recipe(
+                author_id=author,
+                name=f'{prefix} рецепт {number}',
+                image=IMAGE_NAME,
+                text=f'Описание рецепта {number}. ' * rng.randint(1, 20),
+                cooking_time=rng.randint(1, 240))
+            for number, author in items])
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(
+                recipe=recipe, ingredients_id=ingredient,
+                amount=rng.randint(1, 500))
+            for recipe in recipes
+            for ingredient in sample(
+                rng, self.ingredients, self.ingredient_weights,
+                rng.randint(low, high))])
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe=recipe, tag_id=tag)
+            for recipe in recipes
+            for tag in rng.sample(self.tags, rng.randint(1, len(self.tags)))])
+
+    def generate_relations(self, users, recipes):
+        rng = self.rng
+        recipe_weights = zipf_weights(len(recipes), self.options['zipf'])
+        author_weights = zipf_weights(len(users), self.options['zipf'])
+        for label, model, per_user, population, weights, field in (
+                ('Избранное', FavoriteRecipes,
+                 self.options['favorites_per_user'],
+                 recipes, recipe_weights, 'recipe_id'),
+                ('Списки покупок', ShoppingCart,
+                 self.options['cart_per_user'],
+                 recipes, recipe_weights, 'recipe_id'),
+                ('Подписки', Subscription,
+                 self.options['subscriptions_per_user'],
+                 users, author_weights, 'author_id')):
+            self.bulk_insert(label, model, (
+                model(user_id=user, **{field: target})
+                for user in users
+                for target in sample(rng, population, weights, per_user)
+                if target != user or field != 'author_id'))
@@ -1,68 +1,184 @@
-# flake8: noqa
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
-from foodgram_backend.local_settings import (
-    FILE_PATH,
-    FILE_PATH_TAGS,
-    FILE_PATH_USERS,
-    FILE_PATH_RECIPES
-)
-from recipes.models import Ingredient, Tag, Recipe, IngredientRecipe
+from recipes.counters import repair_users
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.versions import bump_version
 from users.models import User
 
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(path):
+    """Отдаёт элементы JSON-массива по одному, читая файл частями"""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf8') as file:
+        buffer = file.read(READ_CHUNK_SIZE).lstrip()
+        if not buffer.startswith('['):
+            raise CommandError(f'{path}: ожидается JSON-массив')
+        buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip()
+            if buffer.startswith(','):
+                buffer = buffer[1:].lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                chunk = file.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    raise CommandError(f'{path}: файл оборван')
+                buffer += chunk
+                continue
+            yield item
+            buffer = buffer[end:]
+
+
+def resolve(mapping, key, label):
+    try:
+        return mapping[key]
+    except KeyError:
+        raise CommandError(f'{label} «{key}» не найден')
+
+
+def batches(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
 
 class Command(BaseCommand):
     help = 'Загрузка данных из JSON файлов'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько записей вставлять за одну транзакцию')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Число процессов для хеширования паролей')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Прочитать и проверить данные в одной транзакции, '
+                 'которая в конце откатывается')
+
     def handle(self, *args, **options):
-        with open(FILE_PATH, encoding="utf8") as f:
-            data = json.load(f)
-            for item in data:
-                try:
-                    Ingredient.objects.create(**item)
-                except:
-                    pass
-        with open(FILE_PATH_TAGS, encoding="utf8") as f:
-            data = json.load(f)
-            for item in data:
-                try:
-                    Tag.objects.create(**item)
-                except:
-                    pass
-        with open(FILE_PATH_USERS, encoding="utf8") as f:
-            data = json.load(f)
-            for item in data:
-                try:
-                    user = User.objects.create(**item)
-                    user.set_password(item['password'])
-                    user.save()
-                except:
-                    pass
-
-        with open(FILE_PATH_RECIPES, encoding="utf8") as f:
-            data = json.load(f)
-            for el in data:
-                author = el.pop('author')
-                tags = el.pop('tags')
-                ingredients = el.pop('ingredients')
-                author_name = User.objects.get(username=author['username'])
-                el['author'] = author_name
-                recipe = Recipe.objects.create(**el)
-                for ing in ingredients:
-                    IngredientRecipe.objects.create(
-                        recipe=recipe,
-                        ingredients=Ingredient.objects.get(name=ing['name']),
-                        amount=ing['amount'])
-                t_list = []
-                for t in tags:
-                    tag = Tag.objects.get(name=t['name'])
-                    t_list.append(tag.id)
-                    # print(type(tag))
-                recipe.tags.set(t_list)
-                recipe.save()
+        self.batch_size = options['batch_size']
+        self.workers = options['workers']
+        if options['dry_run']:
+            with transaction.atomic():
+                self.load_all()
+                transaction.set_rollback(True)
+            self.stdout.write(self.style.WARNING(
+                'Пробный запуск: изменения отменены.'))
+            return
+        # Каждая пачка фиксируется своей транзакцией: после сбоя загрузку
+        # можно перезапустить, уже вставленные записи пропускаются
+        try:
+            self.load_all()
+        finally:
+            bump_version(Ingredient)
+            bump_version(Tag)
+            bump_version(IngredientRecipe)
+        self.stdout.write(
+            self.style.SUCCESS('Загрузка данных прошла успешно.'))
 
+    def load_all(self):
+        self.load_ingredients(settings.FILE_PATH)
+        self.load_tags(settings.FILE_PATH_TAGS)
+        self.load_users(settings.FILE_PATH_USERS)
+        self.load_recipes(settings.FILE_PATH_RECIPES)
 
+    def report(self, label, done, started):
+        elapsed = time.monotonic() - started
         self.stdout.write(
-            self.style.SUCCESS('Загрузка данных прошла успешно.'))
+            f'{label}: {done} записей, {done / (elapsed or 1e-9):.0f} в сек.')
+
+    def bulk_load(self, label, model, rows):
+        started = time.monotonic()
+        done = 0
+        for batch in batches(rows, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    [model(**row) for row in batch], ignore_conflicts=True)
+            done += len(batch)
+            self.report(label, done, started)
+
+    def load_ingredients(self, path):
+        self.bulk_load('Ингредиенты', Ingredient, iter_json_array(path))
+
+    def load_tags(self, path):
+        self.bulk_load('Теги', Tag, iter_json_array(path))
+
+    def load_users(self, path):
+        started = time.monotonic()
+        done = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for batch in batches(iter_json_array(path), self.batch_size):
+                passwords = pool.map(
+                    make_password,
+                    [str(item.pop('password')) for item in batch],
+                    chunksize=max(1, len(batch) // 32))
+                users = [
+                    User(password=password, **item)
+                    for item, password in zip(batch, passwords)]
+                with transaction.atomic():
+                    User.objects.bulk_create(users, ignore_conflicts=True)
+                done += len(batch)
+                self.report('Пользователи', done, started)
+
+    def load_recipes(self, path):
+        ingredients = dict(Ingredient.objects.values_list('name', 'id'))
+        tags = dict(Tag.objects.values_list('name', 'id'))
+        authors = dict(User.objects.values_list('username', 'id'))
+        existing = set(Recipe.objects.values_list('author_id', 'name'))
+        started = time.monotonic()
+        done = 0
+        for batch in batches(iter_json_array(path), self.batch_size):
+            for item in batch:
+                item['author_id'] = resolve(
+                    authors, item['author']['username'], 'Автор')
+            batch = [
+                item for item in batch
+                if (item['author_id'], item['name']) not in existing]
+            with transaction.atomic():
+                self.create_recipes(batch, ingredients, tags)
+            existing.update(
+                (item['author_id'], item['name']) for item in batch)
+            done += len(batch)
+            self.report('Рецепты', done, started)
+
+    def create_recipes(self, batch, ingredients, tags):
+        recipes = Recipe.objects.bulk_create([
+            Recipe(
+                author_id=item['author_id'],
+                name=item['name'],
+                image=item['image'].rpartition(settings.MEDIA_URL)[2],
+                text=item['text'],
+                cooking_time=item['cooking_time'])
+            for item in batch])
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(
+                recipe=recipe,
+                ingredients_id=resolve(
+                    ingredients, ingredient['name'], 'Ингредиент'),
+                amount=ingredient['amount'])
+            for recipe, item in zip(recipes, batch)
+            for ingredient in item['ingredients']
+        ], ignore_conflicts=True)
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(
+                recipe=recipe, tag_id=resolve(tags, tag['name'], 'Тег'))
+            for recipe, item in zip(recipes, batch)
+            for tag in item['tags']
+        ], ignore_conflicts=True)
+        repair_users(User.objects.filter(
+            pk__in={item['author_id'] for item in batch}))
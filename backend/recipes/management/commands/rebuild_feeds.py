@@ -0,0 +1,29 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.feed import backfill
+from recipes.models import FeedEntry
+from users.models import Subscription
+
+
+class Command(BaseCommand):
+    help = 'Пересборка лент подписок из подписок и рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько пользователей пересобирать в одной транзакции')
+
+    def handle(self, *args, **options):
+        subscribers = Subscription.objects.order_by('user_id').values_list(
+            'user_id', flat=True).distinct().iterator()
+        done = 0
+        while batch := list(islice(subscribers, options['batch_size'])):
+            with transaction.atomic():
+                FeedEntry.objects.filter(user_id__in=batch).delete()
+                backfill(batch)
+            done += len(batch)
+            self.stdout.write(f'Ленты: {done} пользователей')
+        self.stdout.write(self.style.SUCCESS('Ленты пересобраны.'))
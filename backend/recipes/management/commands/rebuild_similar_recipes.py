@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import RecipeNeighbor
+from recipes.similarity import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Полный пересчёт похожих рецептов в нескольких процессах'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Число процессов для расчёта')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Сколько рецептов отдавать процессу за раз')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Сколько строк вставлять одним запросом')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        chunks = rebuild(options['workers'], options['chunk_size'])
+        self.stdout.write(
+            f'Расчёт: {time.monotonic() - started:.1f} сек.')
+        done = 0
+        with transaction.atomic():
+            RecipeNeighbor.objects.all().delete()
+            for recipe_ids, neighbor_ids, scores in chunks:
+                RecipeNeighbor.objects.bulk_create([
+                    RecipeNeighbor(
+                        recipe_id=recipe_id, neighbor_id=neighbor_id,
+                        score=score)
+                    for recipe_id, neighbor_id, score in zip(
+                        recipe_ids.tolist(), neighbor_ids.tolist(),
+                        scores.tolist())
+                ], batch_size=options['batch_size'])
+                done += len(recipe_ids)
+                self.stdout.write(f'Соседи: {done} строк')
+        self.stdout.write(self.style.SUCCESS('Похожие рецепты пересчитаны.'))
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Max
+
+from recipes.counters import repair_recipes, repair_users
+from recipes.models import Recipe
+from users.models import User
+
+
+def repair_chunk(repair, model, start, stop):
+    close_old_connections()
+    try:
+        return repair(model.objects.filter(pk__gte=start, pk__lt=stop))
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт счётчиков избранного, покупок, рецептов и подписчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Сколько id обрабатывать в одном запросе')
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Число параллельных соединений с базой')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for label, model, repair in (
+                    ('Рецепты', Recipe, repair_recipes),
+                    ('Пользователи', User, repair_users)):
+                last_id = model.objects.aggregate(Max('pk'))['pk__max'] or 0
+                fixed = sum(pool.map(
+                    lambda start: repair_chunk(
+                        repair, model, start, start + chunk_size),
+                    range(0, last_id + 1, chunk_size)))
+                self.stdout.write(f'{label}: исправлено {fixed}')
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны.'))
@@ -0,0 +1,42 @@
+# Generated by Django 3.2 on 2026-10-18 09:43
+
+from django.db import migrations, models
+
+FILL_COUNTERS = '''
+UPDATE recipes_recipe SET
+    favorites_count = (
+        SELECT count(*) FROM recipes_favoriterecipes
+        WHERE recipe_id = recipes_recipe.id),
+    in_carts_count = (
+        SELECT count(*) FROM recipes_shoppingcart
+        WHERE recipe_id = recipes_recipe.id);
+UPDATE users_user SET
+    recipes_count = (
+        SELECT count(*) FROM recipes_recipe
+        WHERE author_id = users_user.id),
+    followers_count = (
+        SELECT count(*) FROM users_subscription
+        WHERE author_id = users_user.id);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_image_derivatives'),
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunSQL(FILL_COUNTERS, migrations.RunSQL.noop),
+    ]
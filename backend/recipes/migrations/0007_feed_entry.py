@@ -0,0 +1,63 @@
+# Generated by Django 3.2 on 2026-10-18 10:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# То же, что feed.BACKFILL_SQL для всех подписчиков разом, с обрезкой
+# каждой ленты до FEED_MAX_LENGTH
+FILL_FEED_ENTRIES = '''
+INSERT INTO recipes_feedentry (user_id, recipe_id, author_id)
+SELECT user_id, recipe_id, author_id FROM (
+    SELECT subscription.user_id, recipe.id AS recipe_id, recipe.author_id,
+        row_number() OVER (
+            PARTITION BY subscription.user_id ORDER BY recipe.id DESC
+        ) AS position
+    FROM users_subscription AS subscription
+    JOIN users_user AS author
+        ON author.id = subscription.author_id
+        AND author.followers_count < %(hot)s
+    CROSS JOIN LATERAL (
+        SELECT id, author_id FROM recipes_recipe
+        WHERE author_id = subscription.author_id
+        ORDER BY id DESC LIMIT %(limit)s
+    ) AS recipe
+) AS ranked
+WHERE position <= %(limit)s;
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0006_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='recipes.recipe')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', 'author'], name='feed_entry_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feed_entry'),
+        ),
+        migrations.RunSQL(
+            [(FILL_FEED_ENTRIES, {
+                'hot': settings.FEED_HOT_AUTHOR_FOLLOWERS,
+                'limit': settings.FEED_MAX_LENGTH})],
+            migrations.RunSQL.noop),
+    ]
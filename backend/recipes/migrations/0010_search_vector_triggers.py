@@ -0,0 +1,110 @@
+# Generated by Django 3.2 on 2026-10-18 10:43
+
+from django.db import migrations
+
+CREATE_TRIGGERS = '''
+CREATE FUNCTION recipes_search_vector(
+    recipe bigint, recipe_name text, recipe_text text
+) RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT setweight(to_tsvector('russian', coalesce(recipe_name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM recipes_ingredientrecipe AS ingredient_recipe
+            JOIN recipes_ingredient AS ingredient
+                ON ingredient.id = ingredient_recipe.ingredients_id
+            WHERE ingredient_recipe.recipe_id = recipe), '')), 'B')
+        || setweight(to_tsvector('russian', coalesce(recipe_text, '')), 'C')
+$$;
+
+CREATE FUNCTION recipes_recipe_search_vector() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := recipes_search_vector(NEW.id, NEW.name, NEW.text);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER recipes_recipe_search_vector
+BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_vector();
+
+CREATE FUNCTION recipes_links_search_vector() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE recipes_recipe
+        SET search_vector = recipes_search_vector(id, name, text)
+        WHERE id IN (SELECT recipe_id FROM new_links);
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE recipes_recipe
+        SET search_vector = recipes_search_vector(id, name, text)
+        WHERE id IN (SELECT recipe_id FROM old_links);
+    ELSE
+        UPDATE recipes_recipe
+        SET search_vector = recipes_search_vector(id, name, text)
+        WHERE id IN (
+            SELECT unnest(ARRAY[old_link.recipe_id, new_link.recipe_id])
+            FROM old_links AS old_link
+            JOIN new_links AS new_link USING (id)
+            WHERE (old_link.recipe_id, old_link.ingredients_id)
+                IS DISTINCT FROM (new_link.recipe_id, new_link.ingredients_id));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER recipes_links_inserted
+AFTER INSERT ON recipes_ingredientrecipe
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION recipes_links_search_vector();
+
+CREATE TRIGGER recipes_links_updated
+AFTER UPDATE ON recipes_ingredientrecipe
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION recipes_links_search_vector();
+
+CREATE TRIGGER recipes_links_deleted
+AFTER DELETE ON recipes_ingredientrecipe
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION recipes_links_search_vector();
+
+CREATE FUNCTION recipes_ingredient_search_vector() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE recipes_recipe
+    SET search_vector = recipes_search_vector(id, name, text)
+    WHERE id IN (
+        SELECT recipe_id FROM recipes_ingredientrecipe
+        WHERE ingredients_id = NEW.id);
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER recipes_ingredient_search_vector
+AFTER UPDATE OF name ON recipes_ingredient
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION recipes_ingredient_search_vector();
+'''
+
+DROP_TRIGGERS = '''
+DROP TRIGGER recipes_ingredient_search_vector ON recipes_ingredient;
+DROP FUNCTION recipes_ingredient_search_vector();
+DROP TRIGGER recipes_links_deleted ON recipes_ingredientrecipe;
+DROP TRIGGER recipes_links_updated ON recipes_ingredientrecipe;
+DROP TRIGGER recipes_links_inserted ON recipes_ingredientrecipe;
+DROP FUNCTION recipes_links_search_vector();
+DROP TRIGGER recipes_recipe_search_vector ON recipes_recipe;
+DROP FUNCTION recipes_recipe_search_vector();
+DROP FUNCTION recipes_search_vector(bigint, text, text);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_shopping_list_item'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
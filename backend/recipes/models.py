@@ -1,8 +1,17 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from users.models import Subscription
 
 User = get_user_model()
 
+SEARCH_CONFIG = 'russian'
+
 
 class Tag(models.Model):
     name = models.CharField(max_length=200)
@@ -36,6 +45,58 @@ class Ingredient(models.Model):
         return f'{self.name}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Выборка рецептов с данными для сериализатора за фиксированное
+    число запросов, независимо от размера страницы"""
+
+    def with_user_annotations(self, user):
+        queryset = self.select_related('author').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipes',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredients')))
+        if not user.is_authenticated:
+            false = models.Value(False, output_field=models.BooleanField())
+            return queryset.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                is_author_subscribed=false)
+        return queryset.annotate(
+            is_favorited=models.Exists(FavoriteRecipes.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_author_subscribed=models.Exists(Subscription.objects.filter(
+                user=user, author=models.OuterRef('author'))))
+
+    def feed_for(self, user):
+        """Лента подписок: записи из предрассчитанной ленты и рецепты
+        популярных авторов, которые по лентам не рассылаются"""
+        hot_authors = list(Subscription.objects.filter(
+            user=user,
+            author__followers_count__gte=settings.FEED_HOT_AUTHOR_FOLLOWERS
+        ).values_list('author_id', flat=True))
+        if not hot_authors:
+            return self.filter(feed_entries__user=user)
+        return self.filter(
+            models.Q(pk__in=FeedEntry.objects.filter(
+                user=user).values('recipe_id'))
+            | models.Q(author_id__in=hot_authors))
+
+    def latest_per_author(self, limit):
+        """Не более limit последних рецептов каждого автора одним запросом
+        (ROW_NUMBER с разбиением по автору)"""
+        ranked = self.annotate(row_number=models.Window(
+            expression=RowNumber(),
+            partition_by=models.F('author'),
+            order_by=models.F('id').desc())).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) AS ranked WHERE row_number <= %s',
+            (*params, limit)))
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -47,17 +108,42 @@ class Recipe(models.Model):
         verbose_name='Название')
     image = models.ImageField(
         upload_to='recipes/images/')
+    image_derivatives = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии картинки')
     text = models.TextField()
     ingredients = models.ManyToManyField(
         Ingredient,
         through='IngredientRecipe')
     tags = models.ManyToManyField(Tag)
     cooking_time = models.IntegerField()
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном')
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок')
+    # Заполняется триггерами базы (миграция 0010) при любой записи рецепта,
+    # его состава или названия ингредиента
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-id']
+        indexes = [
+            GinIndex(
+                fields=['search_vector'], name='recipe_search_vector_idx'),
+            GinIndex(
+                fields=['name'],
+                name='recipe_name_trgm_idx',
+                opclasses=['gin_trgm_ops'])]
 
     def __str__(self) -> str:
         return f'{self.name} ({self.author})'
@@ -130,3 +216,91 @@ class ShoppingCart(models.Model):
 
     def __str__(self) -> str:
         return f'{self.recipe} in shopping cart {self.user}'
+
+
+class ShoppingListItem(models.Model):
+    """Строка списка покупок: сумма ингредиента по всем рецептам
+    в корзине пользователя, поддерживается при каждом изменении корзины"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_index=False,
+        related_name='shopping_list')
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+')
+    amount = models.BigIntegerField()
+    recipes = models.PositiveIntegerField(
+        verbose_name='Рецептов с ингредиентом')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item')]
+
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Список покупок'
+
+    def __str__(self) -> str:
+        return f'{self.ingredient} {self.amount} for {self.user}'
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика, добавляется при публикации рецепта"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_index=False,
+        related_name='feed_entries')
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries')
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'], name='unique_feed_entry')]
+        indexes = [
+            models.Index(
+                fields=['user', 'author'], name='feed_entry_user_author_idx')]
+
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+
+    def __str__(self) -> str:
+        return f'{self.recipe} in feed {self.user}'
+
+
+class RecipeNeighbor(models.Model):
+    """Похожий рецепт из предрассчитанных top-K по составу и тегам"""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        db_index=False,
+        related_name='neighbors')
+    neighbor = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='neighbor_of')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'neighbor'], name='unique_recipe_neighbor')]
+        indexes = [
+            models.Index(
+                fields=['recipe', '-score'], name='recipe_neighbor_score_idx')]
+
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+
+    def __str__(self) -> str:
+        return f'{self.neighbor} similar to {self.recipe}'
@@ -0,0 +1,158 @@
+from django.db import connection, transaction
+
+from users.models import Subscription
+
+from . import shopping_list
+from .counters import increment_many
+from .feed import schedule_backfill, unfollow
+from .models import FavoriteRecipes, Recipe, ShoppingCart
+
+COUNTERS = {
+    FavoriteRecipes: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+    Subscription: 'followers_count',
+}
+
+INSERT_SQL = '''
+    INSERT INTO {table} (user_id, {field}_id)
+    SELECT %(user)s, id FROM {targets} WHERE id = %(target)s{condition}
+    ON CONFLICT DO NOTHING
+'''
+
+DELETE_ONE_SQL = '''
+    DELETE FROM {table} WHERE user_id = %(user)s AND {field}_id = %(target)s
+'''
+
+# Строка связи и счётчик у рецепта или автора меняются одним запросом
+TOGGLE_SQL = '''
+    WITH changed AS ({statement} RETURNING {field}_id AS id)
+    UPDATE {targets} SET {counter} = GREATEST({counter} + %(delta)s, 0)
+    FROM changed WHERE {targets}.id = changed.id
+    RETURNING changed.id
+'''
+
+BULK_INSERT_SQL = '''
+    INSERT INTO {table} (user_id, recipe_id)
+    SELECT %s, id FROM {recipes} WHERE id = ANY(%s)
+    ON CONFLICT DO NOTHING
+    RETURNING recipe_id
+'''
+
+DELETE_SQL = '''
+    DELETE FROM {table} WHERE user_id = %s AND recipe_id = ANY(%s)
+    RETURNING recipe_id
+'''
+
+
+def added(model, user_id, recipe_ids):
+    """Счётчики и список покупок после добавления строк в обход сигналов"""
+    increment_many(Recipe, recipe_ids, COUNTERS[model], 1)
+    if model is ShoppingCart:
+        shopping_list.add(user_id, recipe_ids)
+
+
+def removed(model, user_id, recipe_ids):
+    """Счётчики и список покупок после удаления строк в обход сигналов"""
+    increment_many(Recipe, recipe_ids, COUNTERS[model], -1)
+    if model is ShoppingCart:
+        shopping_list.subtract(user_id, recipe_ids)
+
+
+def toggle(statement, model, field, delta, user_id, target_id):
+    """Добавляет или удаляет строку связи, сдвигая счётчик на delta;
+    True, если строка действительно добавлена или удалена"""
+    names = {
+        'table': model._meta.db_table,
+        'field': field,
+        'targets': model._meta.get_field(field).related_model._meta.db_table,
+        'condition': ' AND id <> %(user)s' if model is Subscription else '',
+    }
+    sql = TOGGLE_SQL.format(
+        statement=statement.format(**names), counter=COUNTERS[model], **names)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql, {'user': user_id, 'target': target_id, 'delta': delta})
+        return cursor.fetchone() is not None
+
+
+def add(model, user_id, recipe_id):
+    """Идемпотентно добавляет рецепт в избранное или корзину: False,
+    если он там уже был или рецепта нет"""
+    if model is ShoppingCart:
+        return add_to_cart(user_id, recipe_id)
+    return toggle(INSERT_SQL, model, 'recipe', 1, user_id, recipe_id)
+
+
+def remove(model, user_id, recipe_id):
+    """Удаляет рецепт из избранного или корзины: False, если его там
+    не было"""
+    if model is ShoppingCart:
+        return remove_from_cart(user_id, recipe_id)
+    return toggle(DELETE_ONE_SQL, model, 'recipe', -1, user_id, recipe_id)
+
+
+@transaction.atomic
+def add_to_cart(user_id, recipe_id):
+    created = toggle(INSERT_SQL, ShoppingCart, 'recipe', 1, user_id, recipe_id)
+    if created:
+        shopping_list.add(user_id, [recipe_id])
+    return created
+
+
+@transaction.atomic
+def remove_from_cart(user_id, recipe_id):
+    deleted = toggle(
+        DELETE_ONE_SQL, ShoppingCart, 'recipe', -1, user_id, recipe_id)
+    if deleted:
+        shopping_list.subtract(user_id, [recipe_id])
+    return deleted
+
+
+def subscribe(user_id, author_id):
+    """Идемпотентная подписка; на себя подписаться нельзя"""
+    created = toggle(
+        INSERT_SQL, Subscription, 'author', 1, user_id, author_id)
+    if created:
+        transaction.on_commit(lambda: schedule_backfill(user_id, author_id))
+    return created
+
+
+@transaction.atomic
+def unsubscribe(user_id, author_id):
+    deleted = toggle(
+        DELETE_ONE_SQL, Subscription, 'author', -1, user_id, author_id)
+    if deleted:
+        unfollow(user_id, author_id)
+        transaction.on_commit(lambda: schedule_backfill(user_id))
+    return deleted
+
+
+def bulk_add(model, user_id, recipe_ids):
+    """Добавляет рецепты в избранное или корзину одним INSERT,
+    возвращает id действительно добавленных"""
+    if not recipe_ids:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            BULK_INSERT_SQL.format(
+                table=model._meta.db_table, recipes=Recipe._meta.db_table),
+            (user_id, list(recipe_ids)))
+        inserted = [pk for pk, in cursor.fetchall()]
+    if inserted:
+        added(model, user_id, inserted)
+    return inserted
+
+
+def bulk_remove(model, user_id, recipe_ids):
+    """Удаляет рецепты из избранного или корзины одним DELETE,
+    возвращает id действительно удалённых"""
+    if not recipe_ids:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            DELETE_SQL.format(table=model._meta.db_table),
+            (user_id, list(recipe_ids)))
+        deleted = [pk for pk, in cursor.fetchall()]
+    if deleted:
+        removed(model, user_id, deleted)
+    return deleted
@@ -0,0 +1,79 @@
+from django.db import connection
+
+from .models import IngredientRecipe, ShoppingCart, ShoppingListItem
+
+ITEMS = ShoppingListItem._meta.db_table
+LINKS = IngredientRecipe._meta.db_table
+CARTS = ShoppingCart._meta.db_table
+
+ADD_SQL = f'''
+    INSERT INTO {ITEMS} AS item (user_id, ingredient_id, amount, recipes)
+    SELECT %(user)s, ingredients_id, SUM(amount), COUNT(*) FROM {LINKS}
+    WHERE recipe_id = ANY(%(recipes)s) AND ingredients_id IS NOT NULL
+    GROUP BY ingredients_id
+    ON CONFLICT (user_id, ingredient_id) DO UPDATE SET
+        amount = item.amount + EXCLUDED.amount,
+        recipes = item.recipes + EXCLUDED.recipes
+'''
+
+SUBTRACT_SQL = f'''
+    UPDATE {ITEMS} AS item SET
+        amount = item.amount - link.amount,
+        recipes = item.recipes - link.recipes
+    FROM (
+        SELECT ingredients_id, SUM(amount) AS amount, COUNT(*) AS recipes
+        FROM {LINKS} WHERE recipe_id = ANY(%(recipes)s)
+        GROUP BY ingredients_id
+    ) AS link
+    WHERE item.user_id = %(user)s
+        AND item.ingredient_id = link.ingredients_id
+'''
+
+DELETE_EMPTY_SQL = f'''
+    DELETE FROM {ITEMS} WHERE user_id = %(user)s AND recipes = 0
+'''
+
+CLEAR_SQL = f'''
+    DELETE FROM {ITEMS}
+    WHERE user_id IN ({{users}})
+        AND (%s::bigint[] IS NULL OR ingredient_id = ANY(%s))
+'''
+
+REBUILD_SQL = f'''
+    INSERT INTO {ITEMS} (user_id, ingredient_id, amount, recipes)
+    SELECT cart.user_id, link.ingredients_id, SUM(link.amount), COUNT(*)
+    FROM {CARTS} AS cart
+    JOIN {LINKS} AS link ON link.recipe_id = cart.recipe_id
+    WHERE cart.user_id IN ({{users}})
+        AND link.ingredients_id IS NOT NULL
+        AND (%s::bigint[] IS NULL OR link.ingredients_id = ANY(%s))
+    GROUP BY cart.user_id, link.ingredients_id
+'''
+
+
+def add(user_id, recipe_ids):
+    """Прибавляет состав рецептов к списку покупок пользователя"""
+    with connection.cursor() as cursor:
+        cursor.execute(ADD_SQL, {'user': user_id, 'recipes': recipe_ids})
+
+
+def subtract(user_id, recipe_ids):
+    """Вычитает состав рецептов из списка покупок; должно выполняться,
+    пока состав рецептов ещё не удалён"""
+    params = {'user': user_id, 'recipes': recipe_ids}
+    with connection.cursor() as cursor:
+        cursor.execute(SUBTRACT_SQL, params)
+        cursor.execute(DELETE_EMPTY_SQL, params)
+
+
+def rebuild(users, ingredient_ids=None):
+    """Пересчитывает из корзин списки покупок пользователей users
+    (выборка из одного столбца с id), при ingredient_ids — только строки
+    этих ингредиентов"""
+    sql, params = users.query.sql_with_params()
+    ingredients = None if ingredient_ids is None else list(ingredient_ids)
+    with connection.cursor() as cursor:
+        for statement in (CLEAR_SQL, REBUILD_SQL):
+            cursor.execute(
+                statement.format(users=sql),
+                (*params, ingredients, ingredients))
@@ -0,0 +1,155 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete
+)
+from django.dispatch import receiver
+
+from users.models import Subscription, User
+
+from . import shopping_list
+from .counters import increment
+from .feed import schedule_backfill, unfollow
+from .models import (
+    FavoriteRecipes,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag
+)
+from .similarity import schedule_refresh
+from .versions import bump_version
+
+COUNTERS = {
+    FavoriteRecipes: (Recipe, 'recipe_id', 'favorites_count'),
+    ShoppingCart: (Recipe, 'recipe_id', 'in_carts_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+    Subscription: (User, 'author_id', 'followers_count'),
+}
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+@receiver((post_save, post_delete), sender=Tag)
+def reference_data_changed(sender, **kwargs):
+    """Версия меняется после коммита, иначе параллельный запрос успеет
+    закешировать старые данные под новой версией. Для IngredientRecipe
+    ловит и правки мимо API: админку, shell, каскад удаления рецепта"""
+    transaction.on_commit(lambda: bump_version(sender))
+
+
+class PendingLinks(threading.local):
+    """Рецепты, чей состав менялся в транзакциях потока, → id изменённых
+    ингредиентов или None, если пересчитывать нужно всё"""
+
+    def __init__(self):
+        self.recipes = {}
+
+
+pending_links = PendingLinks()
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def recipe_links_changed(sender, instance, **kwargs):
+    """Правки состава мимо API (админка, shell, каскад удаления рецепта)
+    копятся по рецептам и попадают в списки покупок одним проходом после
+    коммита. У изменённой строки прежний ингредиент неизвестен, поэтому
+    списки её рецепта пересчитываются целиком"""
+    recipes = pending_links.recipes
+    ingredients = recipes.setdefault(instance.recipe_id, set())
+    if kwargs.get('created') is False:
+        recipes[instance.recipe_id] = None
+    elif ingredients is not None:
+        ingredients.add(instance.ingredients_id)
+    transaction.on_commit(links_committed)
+
+
+def links_committed():
+    """Колбэк регистрируется на каждую строку; первый забирает всё
+    накопленное, остальные ничего не делают. Забытое после отката
+    уйдёт со следующим коммитом — пересчёт идемпотентен"""
+    recipes, pending_links.recipes = pending_links.recipes, {}
+    if not recipes:
+        return
+    with transaction.atomic():
+        for recipe_id, ingredients in recipes.items():
+            shopping_list.rebuild(
+                ShoppingCart.objects.filter(
+                    recipe_id=recipe_id).values('user_id'),
+                None if ingredients is None else ingredients - {None})
+    refresh_neighbors(recipes)
+
+
+def refresh_neighbors(recipe_ids):
+    for recipe_id in recipe_ids:
+        schedule_refresh(recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    """Теги входят в оценку похожести: смена тегов рецепта, в том числе
+    со стороны тега, пересчитывает его соседей"""
+    if not reverse:
+        if action not in ('post_add', 'post_remove', 'post_clear'):
+            return
+        recipe_ids = {instance.pk}
+    elif action == 'pre_clear':
+        recipe_ids = set(instance.recipe_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        recipe_ids = set(pk_set)
+    else:
+        return
+    transaction.on_commit(lambda: refresh_neighbors(recipe_ids))
+
+
+@receiver(post_save, sender=FavoriteRecipes)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscription)
+def counted_row_created(sender, instance, created, **kwargs):
+    if created:
+        model, field, counter = COUNTERS[sender]
+        increment(model, getattr(instance, field), counter, 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipes)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscription)
+def counted_row_deleted(sender, instance, **kwargs):
+    model, field, counter = COUNTERS[sender]
+    increment(model, getattr(instance, field), counter, -1)
+
+
+@receiver(post_save, sender=Subscription)
+def subscribed(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: schedule_backfill(
+            instance.user_id, instance.author_id))
+
+
+@receiver(post_delete, sender=Subscription)
+def unsubscribed(sender, instance, **kwargs):
+    """Убирает рецепты автора из ленты сразу, а освободившееся место
+    дозаполняет рецептами остальных подписок в фоне"""
+    unfollow(instance.user_id, instance.author_id)
+    transaction.on_commit(lambda: schedule_backfill(instance.user_id))
+
+
+@receiver(post_save, sender=ShoppingCart)
+def added_to_cart(sender, instance, created, **kwargs):
+    if created:
+        shopping_list.add(instance.user_id, [instance.recipe_id])
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def removed_from_cart(sender, instance, **kwargs):
+    """pre_delete: при удалении рецепта его состав удаляется каскадом
+    раньше, чем приходят post_delete строк корзины"""
+    shopping_list.subtract(instance.user_id, [instance.recipe_id])
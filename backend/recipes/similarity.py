@@ -0,0 +1,262 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Count, F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from .models import IngredientRecipe, Recipe, RecipeNeighbor
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix='similar-recipes')
+queued = set()
+queued_lock = threading.Lock()
+
+POPCOUNT16 = np.array(
+    [bin(value).count('1') for value in range(1 << 16)], dtype=np.uint8)
+
+STOP_INGREDIENTS_KEY = 'similar_recipes:stop_ingredients'
+
+# Матрица для процессов полной пересборки: дочерние процессы получают её
+# при fork, не сериализуя
+shared_matrix = None
+
+
+def popcount(words):
+    """Число единичных битов в каждой строке массива uint64"""
+    total = np.zeros(words.shape[0], dtype=np.int64)
+    for shift in range(0, 64, 16):
+        total += POPCOUNT16[
+            (words >> np.uint64(shift)) & np.uint64(0xFFFF)].sum(
+                axis=1, dtype=np.int64)
+    return total
+
+
+def compress(rows, cols, size):
+    """Индексы строк и столбцов в формате CSR: (indptr, indices)"""
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr, cols[order]
+
+
+def gather(indptr, indices, rows):
+    """Склеивает строки rows разреженной матрицы: для каждого элемента
+    возвращает номер строки в rows и индекс столбца"""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths)
+    return owners, indices[np.repeat(starts, lengths) + offsets]
+
+
+def top_k(queries, candidates, scores, k):
+    """Оставляет для каждого запроса k кандидатов с наибольшей оценкой;
+    оценки лежат в [0, 1], поэтому хватает одной устойчивой сортировки
+    по ключу «запрос, затем оценка по убыванию»"""
+    order = np.argsort(
+        queries * 2.0 + (1.0 - scores.astype(np.float64)), kind='stable')
+    queries = queries[order]
+    rank = np.arange(len(queries)) - np.searchsorted(queries, queries)
+    keep = order[rank < k]
+    return queries[rank < k], candidates[keep], scores[keep]
+
+
+class RecipeMatrix:
+    """Разреженная матрица рецепт × ингредиент в форматах CSR и CSC
+    и битовые маски тегов рецептов"""
+
+    def __init__(self, ids, links, tag_links):
+        self.ids = ids
+        size = len(ids)
+        rows, links = self.rows_of(links)
+        ingredients, cols = np.unique(links[:, 1], return_inverse=True)
+        self.csr = compress(rows, cols, size)
+        self.csc = compress(cols, rows, len(ingredients))
+        self.sizes = np.diff(self.csr[0])
+        rows, tag_links = self.rows_of(tag_links)
+        tags, cols = np.unique(tag_links[:, 1], return_inverse=True)
+        self.tags = np.zeros((size, max(1, -(-len(tags) // 64))), np.uint64)
+        np.bitwise_or.at(
+            self.tags, (rows, cols // 64),
+            np.left_shift(np.uint64(1), (cols % 64).astype(np.uint64)))
+        self.tag_sizes = popcount(self.tags)
+
+    def rows_of(self, links):
+        """Номера строк для пар (recipe_id, ...); пары рецептов, которых
+        нет в матрице, отбрасываются"""
+        rows = np.searchsorted(self.ids, links[:, 0]).clip(
+            max=max(len(self.ids) - 1, 0))
+        known = self.ids[rows] == links[:, 0] if len(self.ids) else rows < 0
+        return rows[known], links[known]
+
+    def score(self, rows):
+        """Оценки всех пар (строка из rows, рецепт с общим ингредиентом):
+        косинус по составу и коэффициент Жаккара по тегам"""
+        owners, cols = gather(*self.csr, rows)
+        posting_owners, candidates = gather(*self.csc, cols)
+        queries = rows[owners[posting_owners]]
+        other = candidates != queries
+        keys, shared = np.unique(
+            queries[other] * len(self.ids) + candidates[other],
+            return_counts=True)
+        queries, candidates = np.divmod(keys, len(self.ids))
+        cosine = shared / np.sqrt(
+            self.sizes[queries] * self.sizes[candidates])
+        shared_tags = popcount(self.tags[queries] & self.tags[candidates])
+        union = (
+            self.tag_sizes[queries] + self.tag_sizes[candidates]
+            - shared_tags)
+        jaccard = np.divide(
+            shared_tags, union, out=np.zeros(len(union)), where=union > 0)
+        weight = settings.SIMILAR_RECIPES_TAG_WEIGHT
+        return (
+            queries, candidates,
+            ((1 - weight) * cosine + weight * jaccard).astype(np.float32))
+
+    def neighbors(self, rows, k):
+        """Top-k соседей для строк rows: (recipe_id, neighbor_id, score)"""
+        queries, candidates, scores = top_k(*self.score(rows), k)
+        return self.ids[queries], self.ids[candidates], scores
+
+
+def as_array(values):
+    return np.array(list(values), dtype=np.int64).reshape(-1, 2)
+
+
+def count_stop_ingredients():
+    """Ингредиенты из слишком многих рецептов (соль, вода) не делают
+    рецепты похожими и не участвуют в оценке"""
+    ids = list(IngredientRecipe.objects.filter(
+        ingredients__isnull=False
+    ).values('ingredients').annotate(
+        postings=Count('id')
+    ).filter(postings__gt=settings.SIMILAR_RECIPES_MAX_POSTINGS).values_list(
+        'ingredients', flat=True))
+    cache.set(STOP_INGREDIENTS_KEY, ids, None)
+    return ids
+
+
+def stop_ingredients():
+    """Стоп-ингредиенты последней полной пересборки: инкрементальные
+    обновления не пересчитывают их по всей таблице состава"""
+    ids = cache.get(STOP_INGREDIENTS_KEY)
+    if ids is None:
+        ids = count_stop_ingredients()
+    return ids
+
+
+def load_matrix(recipes=None):
+    """Читает матрицу для всех рецептов или для выборки recipes"""
+    if recipes is None:
+        recipes = Recipe.objects.all()
+    ids = recipes.order_by('id').values_list('id', flat=True)
+    links = IngredientRecipe.objects.filter(
+        recipe__in=ids, ingredients__isnull=False
+    ).exclude(ingredients__in=stop_ingredients())
+    tag_links = Recipe.tags.through.objects.filter(recipe__in=ids)
+    return RecipeMatrix(
+        np.fromiter(ids, dtype=np.int64),
+        as_array(links.values_list('recipe_id', 'ingredients_id')),
+        as_array(tag_links.values_list('recipe_id', 'tag_id')))
+
+
+def trim_neighbors(recipe_ids):
+    """Оставляет у рецептов только SIMILAR_RECIPES_TOP_K лучших соседей"""
+    ranked = RecipeNeighbor.objects.filter(recipe_id__in=recipe_ids).annotate(
+        position=Window(
+            expression=RowNumber(),
+            partition_by=F('recipe'),
+            order_by=(F('score').desc(), F('neighbor'))
+        )).values('id', 'position')
+    sql, params = ranked.query.sql_with_params()
+    return RecipeNeighbor.objects.filter(pk__in=RawSQL(
+        f'SELECT id FROM ({sql}) AS ranked WHERE position > %s',
+        (*params, settings.SIMILAR_RECIPES_TOP_K))).delete()
+
+
+def refresh(recipe_id):
+    """Пересчитывает соседей рецепта и его место в списках соседей
+    рецептов, с которыми у него есть общие ингредиенты"""
+    candidates = Recipe.objects.filter(
+        recipes__ingredients__in=IngredientRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).exclude(ingredients__in=stop_ingredients()).values('ingredients'))
+    matrix = load_matrix(candidates.distinct())
+    row = np.searchsorted(matrix.ids, recipe_id)
+    with transaction.atomic():
+        RecipeNeighbor.objects.filter(recipe_id=recipe_id).delete()
+        RecipeNeighbor.objects.filter(neighbor_id=recipe_id).delete()
+        if row == len(matrix.ids) or matrix.ids[row] != recipe_id:
+            return
+        _, others, scores = matrix.score(np.array([row]))
+        ids, scores = matrix.ids[others], scores.tolist()
+        RecipeNeighbor.objects.bulk_create([
+            RecipeNeighbor(recipe_id=recipe_id, neighbor_id=other, score=score)
+            for other, score in zip(ids.tolist(), scores)
+        ] + [
+            RecipeNeighbor(recipe_id=other, neighbor_id=recipe_id, score=score)
+            for other, score in zip(ids.tolist(), scores)])
+        trim_neighbors([recipe_id, *ids.tolist()])
+
+
+def run_in_background(recipe_id):
+    with queued_lock:
+        queued.discard(recipe_id)
+    close_old_connections()
+    try:
+        refresh(recipe_id)
+    except Exception:
+        logger.exception('Не удалось обновить похожие рецепты: %s', recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_refresh(recipe_id):
+    """Обновляет похожие рецепты в фоне; один поток, чтобы обновления
+    соседних рецептов не перекрывались. Рецепт, уже стоящий в очереди,
+    второй раз не ставится: API и сигналы моделей сообщают об одной
+    правке оба"""
+    with queued_lock:
+        if recipe_id in queued:
+            return None
+        queued.add(recipe_id)
+    return executor.submit(run_in_background, recipe_id)
+
+
+def score_chunk(bounds):
+    rows = np.arange(*bounds)
+    result = [
+        shared_matrix.neighbors(
+            rows[start:start + settings.SIMILAR_RECIPES_BATCH_SIZE],
+            settings.SIMILAR_RECIPES_TOP_K)
+        for start in range(0, len(rows), settings.SIMILAR_RECIPES_BATCH_SIZE)]
+    return tuple(np.concatenate(column) for column in zip(*result))
+
+
+def rebuild(workers, chunk_size):
+    """Считает соседей всех рецептов в нескольких процессах; результат
+    по частям: (recipe_ids, neighbor_ids, scores)"""
+    global shared_matrix
+    count_stop_ingredients()
+    shared_matrix = load_matrix()
+    bounds = [
+        (start, min(start + chunk_size, len(shared_matrix.ids)))
+        for start in range(0, len(shared_matrix.ids), chunk_size)]
+    connections.close_all()
+    try:
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('fork')) as pool:
+            return list(pool.map(score_chunk, bounds))
+    finally:
+        shared_matrix = None
@@ -0,0 +1,22 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'model_version:{}'
+
+
+def get_version(model):
+    """Текущая версия данных модели, общая для всех воркеров через кэш"""
+    return cache.get_or_set(
+        VERSION_KEY.format(model._meta.label_lower), time.time_ns(), None)
+
+
+def bump_version(model):
+    """Сдвигает версию модели, чтобы воркеры сбросили свои копии данных"""
+    key = VERSION_KEY.format(model._meta.label_lower)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, None)
+        return version
@@ -1,13 +1,24 @@
 from django.contrib import admin
 
+from recipes.paginators import EstimatedCountPaginator
+
 from .models import Subscription, User
 
-admin.site.register(Subscription)
+
+class SubscriptionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+admin.site.register(Subscription, SubscriptionAdmin)
 
 
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('username', 'email',)
-    list_filter = ('username', 'email',)
+    list_display = ('username', 'email', 'recipes_count', 'followers_count')
+    search_fields = ('username', 'email')
 
 
 admin.site.register(User, UserAdmin)
@@ -8,6 +8,10 @@ class User(AbstractUser):
     last_name = models.CharField('Фамилия', max_length=150)
     email = models.EmailField('Email', max_length=254, unique=True)
     password = models.CharField('Пароль', max_length=150)
+    recipes_count = models.PositiveIntegerField(
+        'Число рецептов', default=0, editable=False)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0, editable=False)
 
 
 class Subscription(models.Model):